@@ -0,0 +1,290 @@
+"""行情處理流程的吞吐量及延遲測試
+
+不登入、不連線，以假的SDK建立MainApp，由背景執行緒依設定的速率產生aggregates的data訊息，
+送進LimitUpEngine.handle_message -> DecodeWorker -> TickBuffer -> flush_ticks -> 表格重繪的完整流程。
+每組(股票數, 類股數, 訊息速率)執行固定秒數，結果寫成JSON以便比較不同版本。
+
+用法:
+    python bench_pipeline.py
+    python bench_pipeline.py --cases 50x10 500x40 2000x80 --rates 1000 5000 20000 --duration 5 --output bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+
+
+class _BenchWebsocket:
+    def on(self, event, handler):
+        pass
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def subscribe(self, params):
+        pass
+
+    def unsubscribe(self, params):
+        pass
+
+
+class _BenchSDK:
+    def __init__(self):
+        self.marketdata = SimpleNamespace(
+            websocket_client=SimpleNamespace(stock=_BenchWebsocket()),
+            rest_client=SimpleNamespace(stock=None),
+        )
+
+    def init_realtime(self, mode):
+        pass
+
+    def logout(self):
+        pass
+
+
+def rss_mb():
+    # 回傳(MB, 種類)，'current'為目前用量，'peak'為整個行程的最大用量(各組測試會累積成最大值，不能互相比較)
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024, 'current'
+    except ImportError:
+        pass
+    try:
+        # Linux不需要psutil也能讀到目前用量，第二個欄位為常駐的page數
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024, 'current'
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Linux回傳KB，macOS回傳bytes
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024), 'peak'
+    except ImportError:
+        return None, None
+
+
+def make_sectors(n_symbols, n_sectors, seed=0):
+    # 每檔股票放進一個類股，約兩成同時出現在第二個類股
+    rng = random.Random(seed)
+    symbols = [str(1101 + i) for i in range(n_symbols)]
+    sectors = {'類股{:02d}'.format(i): [] for i in range(n_sectors)}
+    names = list(sectors)
+    for i, symbol in enumerate(symbols):
+        sectors[names[i % n_sectors]].append((symbol, '股票' + symbol))
+        if rng.random() < 0.2:
+            other = names[rng.randrange(n_sectors)]
+            if other != names[i % n_sectors]:
+                sectors[other].append((symbol, '股票' + symbol))
+    return symbols, sectors
+
+
+_DATA_TEMPLATE = ('{"event":"data","data":{"symbol":"%s","type":"EQUITY","exchange":"TWSE","market":"TSE",'
+                  '"openPrice":%.2f,"highPrice":%.2f,"lowPrice":%.2f,"lastPrice":%.2f,"changePercent":%.2f,'
+                  '"isLimitUpPrice":%s,"isTrial":false,"lastUpdated":%d,"total":{"tradeVolume":%d}},"channel":"aggregates"}')
+
+
+class TickProducer(threading.Thread):
+    """依固定速率產生data訊息並呼叫handler"""
+    def __init__(self, symbols, rate, handler, seed=0):
+        super().__init__(name='TickProducer', daemon=True)
+        self.symbols = symbols
+        self.rate = rate
+        self.handler = handler
+        self.rng = random.Random(seed)
+        self.change = {symbol: 0.0 for symbol in symbols}
+        self.stop_event = threading.Event()
+        self.sent = 0
+
+    def make_message(self):
+        symbol = self.symbols[self.rng.randrange(len(self.symbols))]
+        change = min(10.0, max(-10.0, self.change[symbol] + self.rng.uniform(-0.5, 0.6)))
+        self.change[symbol] = change
+        price = 100 * (1 + change / 100)
+        return _DATA_TEMPLATE % (symbol, 100.0, max(100.0, price), min(100.0, price), price, change,
+                                 'true' if change >= 9.9 else 'false', time.time_ns() // 1000, self.sent)
+
+    def run(self):
+        start = time.perf_counter()
+        while not self.stop_event.is_set():
+            target = int((time.perf_counter() - start) * self.rate)
+            while self.sent < target:
+                self.handler(self.make_message())
+                self.sent += 1
+            time.sleep(0.001)
+
+
+class PaintProbe:
+    """記錄tick從產生到所在表格下一次重繪的延遲"""
+    def __init__(self):
+        from PySide6.QtCore import QObject, QEvent
+
+        probe = self
+        self.sent = {}
+        self.awaiting = []
+        self.latency_us = []
+        self.paints = 0
+
+        class _Filter(QObject):
+            def eventFilter(self, obj, event):
+                if event.type() == QEvent.Paint:
+                    probe.on_paint()
+                return False
+
+        self.filter = _Filter()
+
+    def on_paint(self):
+        self.paints += 1
+        if self.awaiting:
+            now_us = time.time_ns() // 1000
+            self.latency_us.extend(now_us - t for t in self.awaiting)
+            self.awaiting = []
+
+    def attach(self, window):
+        # 攔截解析後的事件記錄產生時間，攔截drain記錄哪些tick等待重繪
+        decode_handler = window.engine.decode_worker.handler
+        sent = self.sent
+
+        def handler(event, data):
+            if event == 'data':
+                sent[data['symbol']] = data['lastUpdated']
+            decode_handler(event, data)
+
+        window.engine.decode_worker.handler = handler
+
+        drain = window.engine.tick_buffer.drain
+
+        def traced_drain():
+            pending = drain()
+            self.awaiting.extend(sent[symbol] for symbol in pending if symbol in sent)
+            return pending
+
+        window.engine.tick_buffer.drain = traced_drain
+        # 第0頁為類股總覽，切到第一個類股分頁量測重繪延遲
+        window.info_tab.setCurrentIndex(1)
+        window.table_view_maps[window.sector_tabs[0]].viewport().installEventFilter(self.filter)
+
+
+def run_case(app, n_symbols, n_sectors, rate, duration):
+    import market_watch
+    from PySide6.QtCore import QTimer, QEventLoop
+
+    symbols, sectors = make_sectors(n_symbols, n_sectors)
+    window = market_watch.MainApp(SimpleNamespace(account='bench'))
+    window.show()
+    window.load_sectors(sectors)
+    app.processEvents()
+
+    probe = PaintProbe()
+    probe.attach(window)
+
+    depth = []
+
+    def sample_depth():
+        depth.append(window.engine.decode_worker.queue.qsize() + window.engine.tick_buffer.stats()['pending'])
+
+    sampler = QTimer()
+    sampler.timeout.connect(sample_depth)
+    sampler.start(50)
+
+    producer = TickProducer(symbols, rate, window.engine.handle_message)
+    loop = QEventLoop()
+    QTimer.singleShot(int(duration * 1000), loop.quit)
+    start = time.perf_counter()
+    producer.start()
+    loop.exec()
+    producer.stop_event.set()
+    producer.join()
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    decode_stats = window.engine.decode_worker.stats()
+    buffer_stats = window.engine.tick_buffer.stats()
+    latency_ms = np.asarray(probe.latency_us, dtype=np.float64) / 1000
+    handled = decode_stats['decoded'] + decode_stats['rejected']
+    result = {
+        'symbols': n_symbols,
+        'sectors': n_sectors,
+        'rate': rate,
+        'duration_s': round(elapsed, 3),
+        'sent': producer.sent,
+        'handled': handled,
+        'dropped': decode_stats['dropped'],
+        'conflated': buffer_stats['conflated'],
+        'flushed': buffer_stats['flushed'],
+        'msgs_per_sec': round(handled / elapsed, 1),
+        'paints': probe.paints,
+        'latency_ms_p50': round(float(np.percentile(latency_ms, 50)), 3) if len(latency_ms) else None,
+        'latency_ms_p99': round(float(np.percentile(latency_ms, 99)), 3) if len(latency_ms) else None,
+        'latency_ms_max': round(float(latency_ms.max()), 3) if len(latency_ms) else None,
+        'queue_depth_max': max(depth) if depth else 0,
+        'queue_depth_mean': round(sum(depth) / len(depth), 1) if depth else 0,
+    }
+    result['rss_mb'], result['rss_kind'] = rss_mb()
+
+    window.close()
+    app.processEvents()
+    window.deleteLater()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='行情處理流程效能測試')
+    parser.add_argument('--cases', nargs='+', default=['50x10', '500x40', '2000x80'], help='股票數x類股數')
+    parser.add_argument('--rates', nargs='+', type=int, default=[1000, 5000, 20000], help='每秒訊息數')
+    parser.add_argument('--duration', type=float, default=5, help='每組測試秒數')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--show', action='store_true', help='顯示視窗(預設使用offscreen)')
+    args = parser.parse_args(argv)
+
+    if not args.show:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    import PySide6
+    from PySide6.QtWidgets import QApplication
+    import market_watch
+
+    market_watch.sdk = _BenchSDK()
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    results = []
+    for case in args.cases:
+        n_symbols, n_sectors = (int(v) for v in case.lower().split('x'))
+        for rate in args.rates:
+            result = run_case(app, n_symbols, n_sectors, rate, args.duration)
+            results.append(result)
+            print('{symbols:>5} symbols {sectors:>3} sectors {rate:>6} msg/s -> {msgs_per_sec:>9} msg/s, '
+                  'p50 {latency_ms_p50} ms, p99 {latency_ms_p99} ms, dropped {dropped}, '
+                  'queue max {queue_depth_max}, rss {rss_mb} ({rss_kind})'.format(**result))
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pyside6': PySide6.__version__,
+            'numpy': np.__version__,
+            'flush_hz': market_watch.FLUSH_HZ,
+            'duration_s': args.duration,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print('results written to', args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import math
+from bisect import bisect_left
+
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PySide6.QtGui import QColor
+
+from limit_up_engine import INFO_HEADER, COLUMN_FIELDS, CHANGE_COL, TICKS_COL, BUCKET_FIRST_COL
+
+
+def format_price(value):
+    if math.isnan(value):
+        return '-'
+    return '{:.2f}'.format(value).rstrip('0').rstrip('.')
+
+
+class SectorTableModel(QAbstractTableModel):
+    """單一類股的表格model，資料直接讀取共用的BoardData
+
+    列順序依漲幅由大到小(或依距漲停檔數由小到大)，以bisect維護排序後的key，
+    某檔排序欄位變動時只移動該列並更新位移範圍內的列號
+    """
+    # 可作為排序依據的欄位
+    SORT_COLUMNS = (CHANGE_COL, TICKS_COL)
+
+    def __init__(self, board, symbol_indices, parent=None):
+        super().__init__(parent)
+        self.board = board
+        self.sort_col = CHANGE_COL
+        # 漲幅相同(或都還沒有資料)時依清單中的原始順序排列
+        self.position_of = {idx: pos for pos, idx in enumerate(symbol_indices)}
+        self._sort()
+
+        # 股票索引 -> 目前的列號，使用端也以此判斷tick是否屬於本表
+        self.row_of = {idx: row for row, idx in enumerate(self.rows)}
+
+    def _sort(self):
+        self.key_of = {idx: self._rank_key(idx) for idx in self.position_of}
+        self.rows = sorted(self.position_of, key=self.key_of.__getitem__)
+        self.sort_keys = [self.key_of[idx] for idx in self.rows]
+
+    def refresh(self):
+        # 分頁隱藏期間不接收tick，重新顯示時依BoardData一次重排並通知整張表更新
+        self.layoutAboutToBeChanged.emit()
+        old_rows = self.rows
+        self._sort()
+        for row, idx in enumerate(self.rows):
+            self.row_of[idx] = row
+        persistent = self.persistentIndexList()
+        if persistent:
+            self.changePersistentIndexList(persistent, [self.index(self.row_of[old_rows[index.row()]], index.column()) for index in persistent])
+        self.layoutChanged.emit()
+        if self.rows:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.rows)-1, len(INFO_HEADER)-1))
+
+    def set_sort_column(self, col):
+        # 點選表頭切換排序欄位，其他欄位不處理
+        if col in self.SORT_COLUMNS and col != self.sort_col:
+            self.sort_col = col
+            self.refresh()
+
+    def _rank_key(self, idx):
+        if self.sort_col == TICKS_COL:
+            ticks = self.board.ticks_to_limit[idx]
+            return (math.inf if ticks < 0 else int(ticks), self.position_of[idx])
+        change = self.board.change[idx]
+        if math.isnan(change):
+            return (math.inf, self.position_of[idx])
+        return (-change, self.position_of[idx])
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(INFO_HEADER)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return INFO_HEADER[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        idx = self.rows[index.row()]
+        col = index.column()
+        board = self.board
+
+        if role == Qt.DisplayRole:
+            field = COLUMN_FIELDS[col]
+            if col == 0:
+                return board.names[idx]
+            elif col == 1:
+                return board.symbols[idx]
+            elif field == 'market':
+                return board.market[idx]
+            elif field == 'limit_up_bucket':
+                return 'Y' if board.limit_up_bucket[idx] <= col - BUCKET_FIRST_COL else '-'
+            elif field == 'ticks_to_limit':
+                ticks = board.ticks_to_limit[idx]
+                return '-' if ticks < 0 else str(ticks)
+            elif field == 'change':
+                value = format_price(board.change[idx])
+                return value if value == '-' else value+'%'
+            else:
+                return format_price(getattr(board, field)[idx])
+
+        elif col == CHANGE_COL and board.limit_up[idx]:
+            if role == Qt.BackgroundRole:
+                return QColor(Qt.red)
+            elif role == Qt.ForegroundRole:
+                return QColor(Qt.white)
+
+        return None
+
+    def row_changed(self, idx, first_col, last_col):
+        if first_col <= self.sort_col <= last_col:
+            self._update_rank(idx)
+        row = self.row_of[idx]
+        self.dataChanged.emit(self.index(row, first_col), self.index(row, last_col))
+
+    def _update_rank(self, idx):
+        new_key = self._rank_key(idx)
+        old_key = self.key_of[idx]
+        if new_key == old_key:
+            return
+        self.key_of[idx] = new_key
+
+        old_row = self.row_of[idx]
+        new_row = bisect_left(self.sort_keys, new_key)
+        if new_row > old_row:
+            # 移除原本那列之後，後面的列號都要減一
+            new_row -= 1
+        if new_row == old_row:
+            self.sort_keys[old_row] = new_key
+            return
+
+        # beginMoveRows的目的位置以移除前的列號表示
+        destination = new_row+1 if new_row > old_row else new_row
+        self.beginMoveRows(QModelIndex(), old_row, old_row, QModelIndex(), destination)
+        del self.sort_keys[old_row]
+        del self.rows[old_row]
+        self.sort_keys.insert(new_row, new_key)
+        self.rows.insert(new_row, idx)
+        for row in range(min(old_row, new_row), max(old_row, new_row)+1):
+            self.row_of[self.rows[row]] = row
+        self.endMoveRows()
@@ -0,0 +1,62 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+# 看盤表狀態快照資料夾，每個交易日一個檔案
+SNAPSHOT_DIR = Path('./board_snapshot')
+# 盤中定時寫入快照的間隔秒數
+SNAPSHOT_INTERVAL = 60
+
+# 每檔一筆的固定長度結構，價格為NaN表示尚未收到，時間為微秒，0表示未知
+SNAPSHOT_DTYPE = np.dtype([
+    ('symbol', 'U8'),
+    ('market', 'U4'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('last', 'f8'),
+    ('change', 'f8'),
+    ('reference', 'f8'),
+    ('limit_up', '?'),
+    ('limit_up_time', 'i8'),
+    ('last_time', 'i8'),
+])
+
+
+def snapshot_path(day=None, snapshot_dir=SNAPSHOT_DIR):
+    day = day or datetime.now()
+    return Path(snapshot_dir) / day.strftime('board_%Y%m%d.npy')
+
+
+def data_day(tick_times):
+    """資料所屬的交易日，依最後一筆tick的時間(微秒)，沒有任何時間時回傳None
+
+    快照檔名的日期以此為準，不用寫入當下的時間，跨過午夜才寫入的快照仍標為資料當天
+    """
+    latest = int(np.max(tick_times)) if len(tick_times) else 0
+    if latest <= 0:
+        return None
+    return datetime.fromtimestamp(latest / 1000000).date()
+
+
+def write_snapshot(records, path):
+    # 先寫到暫存檔再取代，寫到一半結束也不會留下壞掉的快照
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, records)
+    os.replace(tmp_path, path)
+
+
+def open_snapshot(path):
+    """以memory map開啟快照，檔案不存在或格式不符時回傳None"""
+    try:
+        records = np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if records.dtype != SNAPSHOT_DTYPE:
+        return None
+    return records
@@ -0,0 +1,130 @@
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+# 一分K快取資料夾，每個交易日一個檔案
+CACHE_DIR = Path('./candle_cache')
+BACKFILL_WORKERS = 4
+# 行情REST查詢每分鐘上限約300次，這裡以每秒5次平均送出
+BACKFILL_RATE = 5.0
+# 被限流(429)時暫停的秒數及最多重試次數
+RATE_LIMIT_PAUSE = 10.0
+BACKFILL_RETRIES = 3
+
+
+class RateLimiter:
+    """多個執行緒共用的固定間隔限流，penalize讓所有執行緒一起暫停"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        with self.lock:
+            self.next_time = max(self.next_time, time.monotonic() + seconds)
+
+
+def _is_rate_limited(error):
+    message = str(error).lower()
+    return '429' in message or 'rate limit' in message or 'too many' in message
+
+
+def _today_range():
+    # 今天0點到明天0點(微秒)
+    day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(day.timestamp() * 1000000), int((day + timedelta(days=1)).timestamp() * 1000000)
+
+
+def _candle_time(date):
+    # '2024-06-03T09:05:00.000+08:00' -> 微秒
+    return int(datetime.fromisoformat(date).timestamp() * 1000000)
+
+
+class CandleBackfill:
+    """盤中啟動時回補當天的一分K
+
+    以有上限的執行緒池查詢reststock.intraday.candles，所有查詢共用一個限流器。
+    結果存成 candle_cache/candles_YYYYMMDD.pkl，{股票代號: (查詢時間, K棒時間陣列, 最高價陣列)}，
+    重新啟動時查詢時間不早於valid_after的股票直接使用快取
+    """
+    def __init__(self, reststock, log=print, workers=BACKFILL_WORKERS, rate=BACKFILL_RATE, cache_dir=CACHE_DIR):
+        self.reststock = reststock
+        self.log = log
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.cache_dir = Path(cache_dir)
+        self.rate_limited = 0
+        self.failed = 0
+
+    def cache_path(self, day=None):
+        day = day or datetime.now()
+        return self.cache_dir / day.strftime('candles_%Y%m%d.pkl')
+
+    def _load_cache(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return {}
+
+    def _save_cache(self, path, cache):
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(path, 'wb') as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            self.log(f'K線快取寫入失敗: {e}')
+
+    def _fetch(self, symbol):
+        for attempt in range(BACKFILL_RETRIES + 1):
+            self.limiter.acquire()
+            fetched_at = int(time.time() * 1000000)
+            try:
+                result = self.reststock.intraday.candles(symbol=symbol, timeframe='1')
+            except Exception as e:
+                if _is_rate_limited(e) and attempt < BACKFILL_RETRIES:
+                    self.rate_limited += 1
+                    self.limiter.penalize(RATE_LIMIT_PAUSE)
+                    continue
+                self.failed += 1
+                self.log(f'查詢{symbol}一分K失敗: {e}')
+                return None
+            candles = (result or {}).get('data') or []
+            times = np.array([_candle_time(candle['date']) for candle in candles], dtype=np.int64)
+            highs = np.array([candle['high'] for candle in candles], dtype=np.float64)
+            # 盤前查詢時可能回傳上一個交易日的K棒，只保留今天的
+            day_start, day_end = _today_range()
+            today = (times >= day_start) & (times < day_end)
+            return fetched_at, times[today], highs[today]
+        return None
+
+    def load(self, symbols, valid_after=0):
+        """回傳{股票代號: (K棒時間陣列, 最高價陣列)}"""
+        start = time.perf_counter()
+        path = self.cache_path()
+        cache = self._load_cache(path)
+        missing = [symbol for symbol in symbols if symbol not in cache or cache[symbol][0] < valid_after]
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='Backfill') as pool:
+                for symbol, result in zip(missing, pool.map(self._fetch, missing)):
+                    if result is not None:
+                        cache[symbol] = result
+            self._save_cache(path, cache)
+
+        self.log('回補一分K: {}檔, 使用快取{}檔, 查詢{}檔, 失敗{}檔, 限流重試{}次, 耗時{:.0f}ms'.format(
+            len(symbols), len(symbols)-len(missing), len(missing), self.failed, self.rate_limited, (time.perf_counter()-start)*1000))
+        return {symbol: cache[symbol][1:] for symbol in symbols if symbol in cache}
@@ -0,0 +1,423 @@
+"""本機假行情伺服器及可替換SDK的假client
+
+伺服器使用與富邦行情websocket相同的事件格式(subscribed/unsubscribed/snapshot/data/heartbeat)，
+可設定每秒tick數、試撮比例、錯誤訊息、格式錯誤訊息及定時斷線，用於壓力測試及長時間測試。
+另外以同一個websocket提供簡易的REST查詢(intraday/quote、intraday/candles、snapshot/quotes)。
+
+需要安裝websockets套件(pip install websockets)
+
+啟動伺服器:
+    python fake_market.py --port 8765 --rate 2000 --clock 09:00
+看盤程式改連假伺服器(不需登入):
+    FAKE_MARKET_URL=ws://127.0.0.1:8765 python market_watch.py
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from functools import partial
+from types import SimpleNamespace
+
+# 設定此環境變數後market_watch改用FakeSDK連到指定的假伺服器
+FAKE_URL_ENV = 'FAKE_MARKET_URL'
+
+
+def _tick_size(price, etf=False):
+    # ETF(代號00開頭)50元以下0.01元，以上0.05元
+    if etf:
+        return 0.01 if price < 50 else 0.05
+    if price < 10:
+        return 0.01
+    elif price < 50:
+        return 0.05
+    elif price < 100:
+        return 0.1
+    elif price < 500:
+        return 0.5
+    elif price < 1000:
+        return 1
+    return 5
+
+
+def _round_tick(price, down=True, etf=False):
+    tick = _tick_size(price, etf)
+    steps = price / tick
+    steps = math.floor(steps + 1e-9) if down else math.ceil(steps - 1e-9)
+    return round(steps * tick, 2)
+
+
+class _Instrument:
+    def __init__(self, symbol, rng):
+        self.symbol = symbol
+        self.market = 'OTC' if zlib.crc32(symbol.encode()) % 3 == 0 else 'TSE'
+        self.etf = symbol.startswith('00')
+        self.reference = _round_tick(rng.uniform(15, 600), etf=self.etf)
+        self.limit_up = _round_tick(self.reference * 1.1, down=True, etf=self.etf)
+        self.limit_down = _round_tick(self.reference * 0.9, down=False, etf=self.etf)
+        self.open = None
+        self.high = None
+        self.low = None
+        self.last = None
+        self.volume = 0
+        self.last_updated = 0
+
+
+class FakeMarketServer:
+    def __init__(self, host='127.0.0.1', port=8765, rate=1000, trial_ratio=0.0, error_rate=0.0,
+                 malformed_rate=0.0, disconnect_after=0, clock=None, clock_speed=1.0, heartbeat=30, seed=0):
+        self.host = host
+        self.port = port
+        self.rate = rate                          # 每個連線每秒送出的data數
+        self.trial_ratio = trial_ratio            # 試撮訊息比例
+        self.error_rate = error_rate              # 每則訊息改送error事件的機率
+        self.malformed_rate = malformed_rate      # 每則訊息改送格式錯誤JSON的機率
+        self.disconnect_after = disconnect_after  # 連線幾秒後由伺服器主動斷線，0表示不斷線
+        self.heartbeat = heartbeat
+        self.rng = random.Random(seed)
+        self.instruments = {}
+
+        # 模擬時鐘，clock為'HH:MM'時從今天該時間開始，依clock_speed倍速前進
+        self.clock_origin = time.time()
+        if clock:
+            hour, minute = (int(v) for v in clock.split(':'))
+            self.clock_start = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0).timestamp()
+        else:
+            self.clock_start = self.clock_origin
+        self.clock_speed = clock_speed
+
+    def now_us(self):
+        return int((self.clock_start + (time.time() - self.clock_origin) * self.clock_speed) * 1000000)
+
+    def instrument(self, symbol):
+        inst = self.instruments.get(symbol)
+        if inst is None:
+            inst = self.instruments[symbol] = _Instrument(symbol, self.rng)
+        return inst
+
+    def _quote(self, inst):
+        quote = {
+            'date': datetime.fromtimestamp(self.now_us() / 1000000).strftime('%Y-%m-%d'),
+            'type': 'EQUITY',
+            'exchange': 'TPEx' if inst.market == 'OTC' else 'TWSE',
+            'market': inst.market,
+            'symbol': inst.symbol,
+            'name': inst.symbol,
+            'referencePrice': inst.reference,
+            'previousClose': inst.reference,
+            'total': {'tradeVolume': inst.volume},
+            'lastUpdated': inst.last_updated or self.now_us(),
+        }
+        if inst.last is not None:
+            change = round(inst.last - inst.reference, 2)
+            quote.update({
+                'openPrice': inst.open,
+                'highPrice': inst.high,
+                'lowPrice': inst.low,
+                'closePrice': inst.last,
+                'lastPrice': inst.last,
+                'change': change,
+                'changePercent': round(change / inst.reference * 100, 2),
+                'isLimitUpPrice': inst.last >= inst.limit_up,
+                'isLimitDownPrice': inst.last <= inst.limit_down,
+            })
+        else:
+            quote.update({'change': 0, 'changePercent': 0})
+        return quote
+
+    def _step(self, inst, trial):
+        # 隨機漫步，偏多一點讓部分股票會碰到漲停
+        base = inst.last if inst.last is not None else inst.reference
+        ticks = self.rng.choice((-2, -1, -1, 0, 1, 1, 1, 2))
+        price = base + ticks * _tick_size(base, inst.etf)
+        price = min(inst.limit_up, max(inst.limit_down, round(price, 2)))
+        if trial:
+            data = self._quote(inst)
+            data.update({'lastPrice': price, 'isTrial': True})
+            return data
+
+        inst.last = price
+        inst.open = price if inst.open is None else inst.open
+        inst.high = price if inst.high is None else max(inst.high, price)
+        inst.low = price if inst.low is None else min(inst.low, price)
+        inst.volume += self.rng.randint(1, 50)
+        inst.last_updated = self.now_us()
+        return self._quote(inst)
+
+    def candles(self, symbol, timeframe='1', **params):
+        # 以股票代號為種子產生今天09:00到現在的一分K
+        inst = self.instrument(symbol)
+        rng = random.Random(symbol)
+        now = datetime.fromtimestamp(self.now_us() / 1000000)
+        t = now.replace(hour=9, minute=0, second=0, microsecond=0)
+        end = min(now, now.replace(hour=13, minute=30, second=0, microsecond=0))
+        price = inst.reference
+        data = []
+        while t < end:
+            open_price = price
+            high_price = low_price = price
+            for _ in range(4):
+                price = min(inst.limit_up, max(inst.limit_down, round(price + rng.choice((-1, 0, 1, 1)) * _tick_size(price, inst.etf), 2)))
+                high_price = max(high_price, price)
+                low_price = min(low_price, price)
+            data.append({
+                'date': t.strftime('%Y-%m-%dT%H:%M:%S.000+08:00'),
+                'open': open_price, 'high': high_price, 'low': low_price, 'close': price,
+                'volume': rng.randint(1, 500), 'average': round((high_price + low_price) / 2, 2),
+            })
+            t += timedelta(minutes=int(timeframe))
+        return {'symbol': symbol, 'type': 'EQUITY', 'exchange': 'TWSE', 'market': inst.market, 'timeframe': timeframe, 'data': data}
+
+    def rest(self, path, params):
+        if path == 'intraday/quote':
+            return self._quote(self.instrument(params['symbol']))
+        elif path == 'intraday/candles':
+            return self.candles(**params)
+        elif path == 'snapshot/quotes':
+            market = params.get('market')
+            data = [self._quote(inst) for inst in self.instruments.values() if market in (None, inst.market)]
+            return {'date': datetime.now().strftime('%Y-%m-%d'), 'market': market, 'data': data}
+        raise ValueError('unknown path: ' + path)
+
+    @staticmethod
+    def _event(event, data, **extra):
+        msg = {'event': event, 'data': data}
+        msg.update(extra)
+        return json.dumps(msg, separators=(',', ':'))
+
+    async def _handle(self, websocket, path=None):
+        import websockets
+
+        subscriptions = {}   # id -> symbol
+        producer = asyncio.ensure_future(self._produce(websocket, subscriptions))
+        try:
+            async for raw in websocket:
+                msg = json.loads(raw)
+                event = msg.get('event')
+                data = msg.get('data') or {}
+
+                if event == 'subscribe':
+                    channel = data.get('channel', 'aggregates')
+                    symbols = data.get('symbols') or [data['symbol']]
+                    records = []
+                    for symbol in symbols:
+                        sub_id = '{:x}'.format(self.rng.getrandbits(48))
+                        subscriptions[sub_id] = symbol
+                        records.append({'id': sub_id, 'channel': channel, 'symbol': symbol})
+                    await websocket.send(self._event('subscribed', records if len(records) > 1 else records[0]))
+                    for record in records:
+                        await websocket.send(self._event('snapshot', self._quote(self.instrument(record['symbol'])), id=record['id'], channel=channel))
+
+                elif event == 'unsubscribe':
+                    ids = data.get('ids') or [data['id']]
+                    records = []
+                    for sub_id in ids:
+                        symbol = subscriptions.pop(sub_id, None)
+                        if symbol is not None:
+                            records.append({'id': sub_id, 'channel': 'aggregates', 'symbol': symbol})
+                    if records:
+                        await websocket.send(self._event('unsubscribed', records if len(records) > 1 else records[0]))
+
+                elif event == 'ping':
+                    await websocket.send(self._event('pong', {'state': data.get('state')}))
+
+                elif event == 'rest':
+                    try:
+                        result = self.rest(data['path'], data.get('params') or {})
+                        await websocket.send(self._event('rest', result))
+                    except Exception as e:
+                        await websocket.send(self._event('error', {'message': str(e)}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            producer.cancel()
+
+    async def _produce(self, websocket, subscriptions):
+        interval = 0.01
+        budget = 0.0
+        started = time.perf_counter()
+        last_heartbeat = started
+        while True:
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            if self.disconnect_after and now - started >= self.disconnect_after:
+                await websocket.close(code=1011, reason='injected disconnect')
+                return
+            if self.heartbeat and now - last_heartbeat >= self.heartbeat:
+                last_heartbeat = now
+                await websocket.send(self._event('heartbeat', {'time': self.now_us()}))
+
+            if not subscriptions:
+                continue
+            budget += self.rate * interval
+            sub_ids = list(subscriptions)
+            while budget >= 1:
+                budget -= 1
+                roll = self.rng.random()
+                if roll < self.error_rate:
+                    await websocket.send(self._event('error', {'message': 'injected error'}))
+                    continue
+                if roll < self.error_rate + self.malformed_rate:
+                    await websocket.send('{"event":"data","data":{"symbol":')
+                    continue
+                sub_id = sub_ids[self.rng.randrange(len(sub_ids))]
+                symbol = subscriptions.get(sub_id)
+                if symbol is None:
+                    continue
+                trial = self.rng.random() < self.trial_ratio
+                data = self._step(self.instrument(symbol), trial)
+                await websocket.send(self._event('data', data, id=sub_id, channel='aggregates'))
+
+    async def serve(self, ready=None):
+        import websockets
+
+        async with websockets.serve(self._handle, self.host, self.port, max_size=None):
+            if ready is not None:
+                ready.set()
+            await asyncio.Future()
+
+    def start_in_thread(self):
+        # 在背景執行緒啟動伺服器，回傳連線網址
+        ready = threading.Event()
+        thread = threading.Thread(target=lambda: asyncio.run(self.serve(ready)), name='FakeMarketServer', daemon=True)
+        thread.start()
+        ready.wait(10)
+        return 'ws://{}:{}'.format(self.host, self.port)
+
+
+class FakeWebSocketClient:
+    """取代sdk.marketdata.websocket_client.stock，介面為on/connect/disconnect/subscribe/unsubscribe"""
+    def __init__(self, url):
+        self.url = url
+        self._handlers = {}
+        self._ws = None
+        self._thread = None
+        self._send_lock = threading.Lock()
+
+    def on(self, event, handler):
+        self._handlers[event] = handler
+
+    def _emit(self, event, *args):
+        handler = self._handlers.get(event)
+        if handler is not None:
+            handler(*args)
+
+    def connect(self):
+        from websockets.sync.client import connect
+
+        self._ws = connect(self.url, max_size=None)
+        self._thread = threading.Thread(target=self._run, args=(self._ws,), name='FakeWebSocketClient', daemon=True)
+        self._thread.start()
+        self._emit('connect')
+
+    def _run(self, ws):
+        from websockets.exceptions import ConnectionClosed
+
+        code, reason = 1000, ''
+        try:
+            for message in ws:
+                if message.startswith('{"event":"error"'):
+                    self._emit('error', json.loads(message)['data'].get('message'))
+                else:
+                    self._emit('message', message)
+            close_rcvd = ws.protocol.close_rcvd
+            if close_rcvd is not None:
+                code, reason = close_rcvd.code, close_rcvd.reason
+        except ConnectionClosed as e:
+            if e.rcvd is not None:
+                code, reason = e.rcvd.code, e.rcvd.reason
+            else:
+                code, reason = 1006, 'connection lost'
+        except Exception as e:
+            self._emit('error', e)
+            code, reason = 1006, str(e)
+        self._emit('disconnect', code, reason)
+
+    def _send(self, event, data):
+        with self._send_lock:
+            self._ws.send(json.dumps({'event': event, 'data': data}))
+
+    def subscribe(self, params):
+        self._send('subscribe', params)
+
+    def unsubscribe(self, params):
+        self._send('unsubscribe', params)
+
+    def disconnect(self):
+        if self._ws is not None:
+            self._ws.close()
+
+
+class FakeRestStock:
+    """取代sdk.marketdata.rest_client.stock中用到的查詢"""
+    def __init__(self, url):
+        self.url = url
+        self.intraday = SimpleNamespace(
+            quote=partial(self._get, 'intraday/quote'),
+            candles=partial(self._get, 'intraday/candles'),
+        )
+        self.snapshot = SimpleNamespace(quotes=partial(self._get, 'snapshot/quotes'))
+
+    def _get(self, path, **params):
+        from websockets.sync.client import connect
+
+        with connect(self.url, max_size=None) as ws:
+            ws.send(json.dumps({'event': 'rest', 'data': {'path': path, 'params': params}}))
+            # 略過連線後收到的心跳等其他事件
+            while True:
+                msg = json.loads(ws.recv())
+                if msg['event'] == 'rest':
+                    return msg['data']
+                if msg['event'] == 'error':
+                    raise ValueError(msg['data'].get('message'))
+
+
+class FakeSDK:
+    """取代FubonSDK，只提供看盤程式用到的部分"""
+    def __init__(self, url):
+        self.url = url
+        self.marketdata = SimpleNamespace(websocket_client=None, rest_client=None)
+        self.fake_account = SimpleNamespace(account='FAKE', name='fake', branch_no='0000', account_type='stock')
+
+    def login(self, *args, **kwargs):
+        return SimpleNamespace(is_success=True, data=[self.fake_account], message='')
+
+    def init_realtime(self, mode=None):
+        self.marketdata.websocket_client = SimpleNamespace(stock=FakeWebSocketClient(self.url))
+        self.marketdata.rest_client = SimpleNamespace(stock=FakeRestStock(self.url))
+
+    def logout(self):
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本機假行情伺服器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rate', type=float, default=1000, help='每個連線每秒data數')
+    parser.add_argument('--trial-ratio', type=float, default=0.0, help='試撮訊息比例')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='改送error事件的機率')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='改送格式錯誤訊息的機率')
+    parser.add_argument('--disconnect-after', type=float, default=0, help='連線幾秒後主動斷線，0為不斷線')
+    parser.add_argument('--clock', default=None, help='模擬時鐘起始時間HH:MM，例如09:00')
+    parser.add_argument('--clock-speed', type=float, default=1.0, help='模擬時鐘倍速')
+    parser.add_argument('--heartbeat', type=float, default=30, help='心跳間隔秒數')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = FakeMarketServer(args.host, args.port, args.rate, args.trial_ratio, args.error_rate,
+                              args.malformed_rate, args.disconnect_after, args.clock, args.clock_speed,
+                              args.heartbeat, args.seed)
+    print('fake market server listening on ws://{}:{}'.format(args.host, args.port))
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+from bisect import bisect_right
+
+import numpy as np
+
+# 價格一律以「分」(0.01元)為單位的整數計算，避免浮點誤差
+# 升降單位: 各價格區間的起點及該區間的跳動單位
+STOCK_BAND_START = (0, 1000, 5000, 10000, 50000, 100000)
+STOCK_BAND_TICK = (1, 5, 10, 50, 100, 500)
+# ETF(代號00開頭): 50元以下0.01元，50元以上0.05元
+ETF_BAND_START = (0, 5000)
+ETF_BAND_TICK = (1, 5)
+
+LIMIT_PERCENT = 10
+
+
+def _band_offsets(starts, ticks):
+    # 每個區間起點之前累計的跳動檔數
+    offsets = [0]
+    for k in range(1, len(starts)):
+        offsets.append(offsets[-1] + (starts[k] - starts[k-1]) // ticks[k-1])
+    return tuple(offsets)
+
+
+STOCK_BAND_OFFSET = _band_offsets(STOCK_BAND_START, STOCK_BAND_TICK)
+ETF_BAND_OFFSET = _band_offsets(ETF_BAND_START, ETF_BAND_TICK)
+LADDERS = (
+    (STOCK_BAND_START, STOCK_BAND_TICK, STOCK_BAND_OFFSET),
+    (ETF_BAND_START, ETF_BAND_TICK, ETF_BAND_OFFSET),
+)
+
+
+def is_etf(symbols):
+    return np.array([symbol.startswith('00') for symbol in symbols], dtype=bool)
+
+
+def to_cents(price):
+    return np.rint(np.asarray(price, dtype=np.float64) * 100).astype(np.int64)
+
+
+def _tick_of(cents, etf):
+    # 向量化查每個價格所在區間的跳動單位
+    stock_tick = np.asarray(STOCK_BAND_TICK)[np.searchsorted(STOCK_BAND_START, cents, side='right') - 1]
+    etf_tick = np.asarray(ETF_BAND_TICK)[np.searchsorted(ETF_BAND_START, cents, side='right') - 1]
+    return np.where(etf, etf_tick, stock_tick)
+
+
+def limit_prices(reference_cents, etf):
+    """由參考價計算漲停價及跌停價(分)，所有股票一次計算
+
+    漲停價為參考價加10%後依該價位的跳動單位無條件捨去，跌停價為減10%後無條件進位
+    """
+    reference_cents = np.asarray(reference_cents, dtype=np.int64)
+    up = reference_cents * (100 + LIMIT_PERCENT) // 100
+    up -= up % _tick_of(up, etf)
+    down = -(-reference_cents * (100 - LIMIT_PERCENT) // 100)
+    down += -down % _tick_of(down, etf)
+    return up, down
+
+
+def tick_index(cents, etf):
+    """價格在升降單位階梯上的位置，兩個價格的差即為相差幾檔
+
+    每筆tick呼叫，只用整數運算及一次bisect
+    """
+    starts, ticks, offsets = LADDERS[etf]
+    k = bisect_right(starts, cents) - 1
+    return offsets[k] + (cents - starts[k]) // ticks[k]
+
+
+def tick_indices(cents, etf):
+    # tick_index的向量化版本
+    cents = np.asarray(cents, dtype=np.int64)
+    result = np.empty(cents.shape, dtype=np.int64)
+    for ladder, mask in ((0, ~etf), (1, etf)):
+        starts, ticks, offsets = (np.asarray(v) for v in LADDERS[ladder])
+        k = np.searchsorted(starts, cents[mask], side='right') - 1
+        result[mask] = offsets[k] + (cents[mask] - starts[k]) // ticks[k]
+    return result
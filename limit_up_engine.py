@@ -0,0 +1,1106 @@
+"""不依賴GUI的漲停看盤引擎
+
+LimitUpEngine負責觀察清單、行情接收及解析、漲停狀態，PySide6的看盤視窗及命令列常駐程式都建立在它之上。
+
+命令列常駐模式(不開視窗)，把漲停事件及定時的類股排行輸出到stdout、CSV或socket:
+    python limit_up_engine.py --list 類股清單.xlsx
+    python limit_up_engine.py --list 類股清單.xlsx --output - --output csv:limit_up.csv --output tcp:0.0.0.0:9000
+    python limit_up_engine.py --list 類股清單.xlsx --fake-url ws://127.0.0.1:8765
+    python limit_up_engine.py --list 類股清單.xlsx --shards 4
+實際連線時使用登入視窗存下的info.pkl帳號資訊登入。
+漲停時間分組預設為9:05、9:15、9:40、10:30，可用環境變數調整，例如 LIMIT_UP_CUTOFFS=09:05,09:40
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import pickle
+import random
+import socket
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from tick_buffer import TickBuffer
+from tick_decoder import DecodeWorker
+from tick_store import TickStore
+from subscription_manager import SubscriptionManager
+from tick_recorder import TickRecorder, start_replay, REPLAY_FILE_ENV, REPLAY_SPEED_ENV
+from time_rules import TimeRules
+from limit_prices import is_etf, limit_prices, tick_index, tick_indices, to_cents
+from watch_list import read_sectors
+from candle_backfill import CandleBackfill
+from pipeline_metrics import PipelineMetrics, Received
+from profiler import SamplingProfiler
+from shard_ingest import ShardedIngest, SHARDS_ENV
+from board_snapshot import SNAPSHOT_DTYPE, SNAPSHOT_INTERVAL, data_day, open_snapshot, snapshot_path, write_snapshot
+
+
+# 漲停時間分組規則(LIMIT_UP_CUTOFFS環境變數設定)，每個時間一個欄位
+TIME_RULES = TimeRules.from_env()
+
+# 看盤表表頭，及每個欄位對應到BoardData中的欄位名稱(None表示靜態欄位)
+INFO_HEADER = ['股票名稱', '股票代號', '市場別', '開盤價','最高價','最低價', '現價', '漲幅(%)', '距漲停(檔)'] + TIME_RULES.labels
+COLUMN_FIELDS = [None, None, 'market', 'open', 'high', 'low', 'last', 'change', 'ticks_to_limit'] + ['limit_up_bucket'] * TIME_RULES.count
+FIELD_COLUMNS = {field: COLUMN_FIELDS.index(field) for field in COLUMN_FIELDS if field is not None}
+CHANGE_COL = FIELD_COLUMNS['change']
+TICKS_COL = FIELD_COLUMNS['ticks_to_limit']
+# 各時間分組欄位的範圍，欄位k顯示「在第k個時間前漲停」
+BUCKET_FIRST_COL = len(COLUMN_FIELDS) - TIME_RULES.count
+BUCKET_LAST_COL = len(COLUMN_FIELDS) - 1
+
+# 斷線重連: 等待時間由RECONNECT_BASE起每次加倍，最多RECONNECT_MAX秒，再乘上0.5~1的隨機值避免同時重連
+RECONNECT_BASE = 1.0
+RECONNECT_MAX = 30.0
+# 重新訂閱後等待RESYNC_GRACE秒，仍未收到snapshot/data的股票改用REST查詢補齊，最多RESYNC_WORKERS個同時查詢
+RESYNC_GRACE = 3.0
+RESYNC_WORKERS = 4
+# 讀取清單後依市場別查詢快照先填滿看盤表
+BOOTSTRAP_MARKETS = ('TSE', 'OTC')
+BOOTSTRAP_WORKERS = 2
+# 分片子行程只送一次、與價格新舊無關的欄位
+SHARD_STICKY_FIELDS = ('market', 'reference')
+
+
+class BoardData:
+    """所有類股共用的行情資料，以股票索引存放在numpy陣列中
+
+    同一檔股票不論出現在幾個類股，都只有一份資料，
+    各類股的SectorTableModel只記錄自己包含哪些股票索引
+    """
+    def __init__(self, symbols, names):
+        self.symbols = list(symbols)
+        self.names = list(names)
+        self.symbol_idx = dict(zip(self.symbols, range(len(self.symbols))))
+
+        n = len(self.symbols)
+        self.market = ['-'] * n
+        self.open = np.full(n, np.nan)
+        self.high = np.full(n, np.nan)
+        self.low = np.full(n, np.nan)
+        self.last = np.full(n, np.nan)
+        self.change = np.full(n, np.nan)
+        self.limit_up = np.zeros(n, dtype=bool)
+        # 最早漲停的時間分組，TIME_RULES.count表示不在任何分組內
+        self.limit_up_bucket = np.full(n, TIME_RULES.count, dtype=np.int8)
+        # 當天最早漲停的時間(微秒)，0表示未知，寫入快照後重新啟動時依此換算分組
+        self.limit_up_time = np.zeros(n, dtype=np.int64)
+
+        # 參考價及漲跌停價(分)，漲停價在升降單位階梯上的位置，收到參考價前為-1
+        self.etf = is_etf(self.symbols)
+        self.reference = np.full(n, np.nan)
+        self.limit_up_price = np.full(n, -1, dtype=np.int64)
+        self.limit_down_price = np.full(n, -1, dtype=np.int64)
+        self.limit_up_index = np.full(n, -1, dtype=np.int64)
+        self.ticks_to_limit = np.full(n, -1, dtype=np.int64)
+
+    def reset_day(self):
+        # 換日時清除前一天的漲停狀態，回傳原本有狀態的股票索引
+        changed = np.flatnonzero(self.limit_up | (self.limit_up_bucket < TIME_RULES.count) | (self.limit_up_time > 0))
+        self.limit_up[:] = False
+        self.limit_up_bucket[:] = TIME_RULES.count
+        self.limit_up_time[:] = 0
+        return changed
+
+    def set_references(self, indices, references):
+        # 一次計算多檔股票的漲跌停價，並依目前的現價更新距漲停檔數
+        indices = np.asarray(indices, dtype=np.int64)
+        references = np.asarray(references, dtype=np.float64)
+        etf = self.etf[indices]
+        self.reference[indices] = references
+        up, down = limit_prices(to_cents(references), etf)
+        self.limit_up_price[indices] = up
+        self.limit_down_price[indices] = down
+        self.limit_up_index[indices] = tick_indices(up, etf)
+
+        last = self.last[indices]
+        known = ~np.isnan(last)
+        ticks = np.full(len(indices), -1, dtype=np.int64)
+        ticks[known] = np.maximum(0, self.limit_up_index[indices[known]] - tick_indices(to_cents(last[known]), etf[known]))
+        self.ticks_to_limit[indices] = ticks
+
+    def _update_ticks(self, idx):
+        # 現價變動時以整數運算更新距漲停檔數，回傳是否有變
+        limit_index = self.limit_up_index[idx]
+        if limit_index < 0:
+            return False
+        last = self.last[idx]
+        ticks = -1 if last != last else max(0, int(limit_index) - tick_index(int(round(last*100)), int(self.etf[idx])))
+        if ticks == self.ticks_to_limit[idx]:
+            return False
+        self.ticks_to_limit[idx] = ticks
+        return True
+
+    def apply(self, idx, fields):
+        # 寫入一檔股票的欄位，回傳值有變動的欄位範圍(first_col, last_col)，都沒變時last_col為-1
+        first_col = len(COLUMN_FIELDS)
+        last_col = -1
+        for field, value in fields.items():
+            if field == 'limit_up':
+                if self.limit_up[idx] == value:
+                    continue
+                self.limit_up[idx] = value
+                col = CHANGE_COL
+            elif field == 'market':
+                if self.market[idx] == value:
+                    continue
+                self.market[idx] = value
+                col = FIELD_COLUMNS[field]
+            elif field == 'reference':
+                if _same_value(self.reference[idx], value):
+                    continue
+                self.set_references([idx], [value])
+                col = TICKS_COL
+            elif field == 'limit_up_bucket':
+                # 只保留最早的分組
+                if value >= self.limit_up_bucket[idx]:
+                    continue
+                self.limit_up_bucket[idx] = value
+                first_col = min(first_col, BUCKET_FIRST_COL)
+                last_col = max(last_col, BUCKET_LAST_COL)
+                continue
+            elif field == 'limit_up_time':
+                # 不顯示在表格上
+                if self.limit_up_time[idx] and value >= self.limit_up_time[idx]:
+                    continue
+                self.limit_up_time[idx] = value
+                continue
+            else:
+                array = getattr(self, field)
+                if _same_value(array[idx], value):
+                    continue
+                array[idx] = value
+                col = FIELD_COLUMNS[field]
+                if field == 'last' and self._update_ticks(idx):
+                    last_col = max(last_col, TICKS_COL)
+            first_col = min(first_col, col)
+            last_col = max(last_col, col)
+        return first_col, last_col
+
+
+def _same_value(old, new):
+    # NaN視為相同
+    return old == new or (old != old and new != new)
+
+
+class SectorAggregate:
+    """單一類股的統計，每筆tick只依新舊值差異調整，不重新掃描整個類股
+
+    計數及漲幅總和為O(1)更新，中位數由bisect維護的已排序漲幅取中間值
+    """
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.limit_up = 0
+        # 各時間分組的漲停檔數，最後一格為不在任何分組內的檔數
+        self.bucket_counts = [0] * TIME_RULES.count + [size]
+        self.advancers = 0
+        self.decliners = 0
+        self.change_sum = 0.0
+        self.sorted_changes = []
+
+    def reset_day(self):
+        self.limit_up = 0
+        self.bucket_counts = [0] * TIME_RULES.count + [self.size]
+
+    def update(self, old_change, new_change, old_limit_up, new_limit_up, old_bucket, new_bucket):
+        self.limit_up += int(new_limit_up) - int(old_limit_up)
+        if old_bucket != new_bucket:
+            self.bucket_counts[old_bucket] -= 1
+            self.bucket_counts[new_bucket] += 1
+        if old_change == new_change:
+            return
+
+        if not math.isnan(old_change):
+            self.change_sum -= old_change
+            self.advancers -= old_change > 0
+            self.decliners -= old_change < 0
+            del self.sorted_changes[bisect_left(self.sorted_changes, old_change)]
+        if not math.isnan(new_change):
+            self.change_sum += new_change
+            self.advancers += new_change > 0
+            self.decliners += new_change < 0
+            insort(self.sorted_changes, new_change)
+
+    def limit_up_by(self, k):
+        # 在第k個時間前漲停的檔數，規則數量很少，直接加總
+        return sum(self.bucket_counts[:k+1])
+
+    @property
+    def count(self):
+        # 已有漲幅資料的檔數
+        return len(self.sorted_changes)
+
+    @property
+    def mean(self):
+        return self.change_sum / self.count if self.count else math.nan
+
+    @property
+    def median(self):
+        n = self.count
+        if n == 0:
+            return math.nan
+        if n % 2:
+            return self.sorted_changes[n // 2]
+        return (self.sorted_changes[n//2 - 1] + self.sorted_changes[n // 2]) / 2
+
+    def record(self):
+        return {
+            'sector': self.name,
+            'size': self.size,
+            'limit_up': self.limit_up,
+            'limit_up_by': {label: self.limit_up_by(k) for k, label in enumerate(TIME_RULES.labels)},
+            'advancers': self.advancers,
+            'decliners': self.decliners,
+            'mean_change': _json_float(self.mean),
+            'median_change': _json_float(self.median),
+        }
+
+
+class LimitUpEngine:
+    """觀察清單、行情接收及漲停狀態
+
+    websocket訊息由handle_message收進DecodeWorker解析，解析後的欄位合併進TickBuffer，
+    使用端(GUI的QTimer或常駐程式的迴圈)定時呼叫apply_pending把緩衝區寫進BoardData，
+    股票由非漲停轉為漲停時通知on_limit_up註冊的callback
+    """
+    def __init__(self, log=print, snapshots=False):
+        self.log = log
+        # 只有連實際行情時才寫入及還原看盤快照，假行情、重播及效能測試不能污染當天的快照
+        self.snapshots = snapshots and not os.environ.get(REPLAY_FILE_ENV)
+        self.websocket = None
+        self.reststock = None
+        self.subscriptions = None
+        # 分片接收模式時為ShardedIngest，行情由子行程接收解析
+        self.shards = None
+
+        # 斷線重連狀態
+        self.user_disconnect = False
+        self.disconnected_at = None
+        self.reconnect_attempts = 0
+        self.reconnect_thread = None
+        self.reconnect_stop = threading.Event()
+        self.stale = set()
+
+        # symbol -> 訂閱id，attach後與SubscriptionManager.acked為同一個dict
+        self.subscribed_ids = {}
+        self.sectors = {}
+        self.symbol_sectors = []
+        self.aggregates = {}
+        self.board = BoardData([], [])
+        self.tick_store = TickStore([])
+        self.tick_buffer = TickBuffer()
+        self.limit_up_listeners = []
+
+        # 每檔最後送進緩衝區的欄位值及資料時間(lastUpdated)，由DecodeWorker執行緒讀寫
+        self.last_fields = {}
+        self.last_time = {}
+        self.out_of_order = 0
+        # 解析執行緒偵測到換日後設為True，由apply_pending清除BoardData及類股統計的漲停狀態
+        self.day_rolled = False
+        self.bootstrap_thread = None
+        self.fields_received = 0
+        self.fields_suppressed = 0
+        self.ticks_suppressed = 0
+
+        self.time_rules = TIME_RULES
+
+        # 行情解析執行緒
+        self.decode_worker = DecodeWorker(self.handle_event, log=self.log)
+        self.decode_worker.start()
+
+        # 原始行情錄製(環境變數開啟)
+        self.recorder = TickRecorder.from_env()
+        if self.recorder is not None:
+            self.log("錄製行情至 {}".format(self.recorder.path))
+        self.replay_thread = None
+
+        # 各階段延遲統計(環境變數開啟)，關閉時為None，處理流程中只多一次判斷
+        self.metrics = PipelineMetrics.from_env()
+        self.last_applied = {}
+        if self.metrics is not None:
+            self.log("延遲統計已開啟，結束時輸出至 {}".format(self.metrics.out_dir))
+
+        # 效能分析(環境變數開啟或由畫面熱鍵切換)，結束時輸出folded堆疊
+        self.profiler = SamplingProfiler.from_env()
+        if self.profiler is not None:
+            self.profiler.start()
+            self.log("效能分析已開啟{:g}秒，結束時輸出至 {}".format(self.profiler.seconds, self.profiler.out_dir))
+
+    def attach(self, websocket, reststock=None, **subscription_options):
+        self.websocket = websocket
+        self.reststock = reststock
+        self.subscriptions = SubscriptionManager(websocket, self.log, **subscription_options)
+        self.subscribed_ids = self.subscriptions.acked
+        self.websocket.on("message", self.handle_message)
+        self.websocket.on("connect", self.handle_connect)
+        self.websocket.on("disconnect", self.handle_disconnect)
+        self.websocket.on("error", self.handle_error)
+
+    def attach_shards(self, shards, reststock=None):
+        # 不使用本行程的websocket，改由子行程分片接收，REST查詢仍在本行程
+        self.reststock = reststock
+        self.shards = shards
+        shards.start(self)
+
+    def on_limit_up(self, callback):
+        self.limit_up_listeners.append(callback)
+
+    # 依{類股名稱: [(股票代號, 股票名稱), ...]}建立觀察清單並訂閱行情
+    def load_sectors(self, sectors):
+        # 同一檔股票在各類股間共用一個索引
+        symbols = []
+        names = []
+        symbol_idx = {}
+        sector_indices = {}
+
+        for col_name, members in sectors.items():
+            sector_indices[col_name] = []
+            for symbol, name in members:
+                if symbol not in symbol_idx:
+                    symbol_idx[symbol] = len(symbols)
+                    symbols.append(symbol)
+                    names.append(name)
+                sector_indices[col_name].append(symbol_idx[symbol])
+
+        self.board = BoardData(symbols, names)
+        self.sectors = sector_indices
+        self.symbol_sectors = [[] for _ in symbols]
+        for col_name, indices in sector_indices.items():
+            for idx in indices:
+                self.symbol_sectors[idx].append(col_name)
+        self.aggregates = {col_name: SectorAggregate(col_name, len(indices)) for col_name, indices in sector_indices.items()}
+        self.tick_store = TickStore(symbols)
+        self.last_fields = {}
+        self.last_time = {}
+        # 在訂閱前先還原今天稍早的看盤狀態
+        self.restore_snapshot()
+        self.log("盤中tick緩衝區: {}檔, 每檔{}筆, 共{:.1f}MB".format(len(symbols), self.tick_store.capacity, self.tick_store.nbytes/1024/1024))
+        self.decode_worker.set_symbols(symbols)
+
+        # symbols已跨類股去重，由SubscriptionManager分批訂閱，舊清單有而新清單沒有的取消訂閱
+        if self.subscriptions is not None:
+            stale = [symbol for symbol in self.subscriptions.symbols if symbol not in symbol_idx]
+            if stale:
+                self.subscriptions.unsubscribe(stale)
+            self.subscriptions.subscribe(symbols)
+        if self.shards is not None:
+            self.shards.load(symbols)
+
+        # 不等websocket逐檔送snapshot，先用REST快照填入目前行情
+        if self.reststock is not None and symbols:
+            self.bootstrap_thread = threading.Thread(target=self.bootstrap, name='Bootstrap', daemon=True)
+            self.bootstrap_thread.start()
+
+        # 重播模式: 把錄製好的行情送進handle_message
+        replay_file = os.environ.get(REPLAY_FILE_ENV)
+        if replay_file and self.replay_thread is None:
+            speed = float(os.environ.get(REPLAY_SPEED_ENV, '1'))
+            self.log("重播行情紀錄 {} ({}倍速)".format(replay_file, speed))
+            self.replay_thread, self.replay_stop = start_replay(replay_file, self.handle_message, speed)
+
+    # SDK的callback執行緒只把原始訊息放進解析佇列，不在這裡做JSON解析
+    def handle_message(self, message):
+        if self.recorder is not None:
+            self.recorder.write(message)
+        if self.metrics is not None:
+            self.decode_worker.submit(Received(time.time_ns(), message))
+        else:
+            self.decode_worker.submit(message)
+
+    # 由DecodeWorker執行緒呼叫，msg已解析完成
+    def handle_event(self, event, data):
+        # subscribed事件處理
+        if event == "subscribed":
+            if self.subscriptions is not None:
+                self.subscriptions.on_subscribed(data)
+
+        # unsubscribed事件處理
+        elif event == "unsubscribed":
+            if self.subscriptions is not None:
+                self.subscriptions.on_unsubscribed(data)
+
+        # subscribed事件處理
+        elif event == "snapshot":
+            if self.is_out_of_order(data):
+                return
+            fields = {
+                'open': data.get('openPrice', math.nan),
+                'high': data.get('highPrice', math.nan),
+                'low': data.get('lowPrice', math.nan),
+                'last': data.get('lastPrice', math.nan),
+                'change': data['changePercent'],
+            }
+            # REST查詢的報價(重新同步)不一定有市場別
+            if 'market' in data:
+                fields['market'] = str(data['market'])
+            if 'referencePrice' in data:
+                fields['reference'] = data['referencePrice']
+            if data.get('isLimitUpPrice'):
+                fields['limit_up'] = True
+            self.put_changed(data['symbol'], fields)
+            self.stale.discard(data['symbol'])
+
+        elif event == "data":
+            # 試撮訊息已在DecodeWorker篩掉
+            if self.is_out_of_order(data):
+                return
+            fields = {
+                'open': data.get('openPrice', math.nan),
+                'high': data.get('highPrice', math.nan),
+                'low': data.get('lowPrice', math.nan),
+                'last': data.get('lastPrice', math.nan),
+                'change': data.get('changePercent', math.nan),
+            }
+            if 'referencePrice' in data:
+                fields['reference'] = data['referencePrice']
+            is_limit_up = data.get('isLimitUpPrice')
+            if is_limit_up is not None:
+                if is_limit_up:
+                    if 'lastUpdated' in data:
+                        fields.update(self.earlier_limit_up(data['symbol'], data['lastUpdated']))
+                    fields['limit_up'] = True
+                else:
+                    fields['limit_up'] = False
+            changed = self.put_changed(data['symbol'], fields)
+            if self.metrics is not None and changed and 'lastUpdated' in data:
+                self.metrics.on_decoded(data['symbol'], data['lastUpdated'], self.decode_worker.recv_ns)
+            self.stale.discard(data['symbol'])
+
+            # 逐筆資料存入盤中環狀緩衝區
+            store = self.tick_store
+            idx = store.symbol_idx.get(data['symbol'])
+            if idx is not None and 'lastPrice' in data:
+                store.append(idx, data.get('lastUpdated', 0), data['lastPrice'], fields['change'], data.get('total', {}).get('tradeVolume', 0))
+
+        # REST快照轉換後的欄位，由bootstrap經DecodeWorker送進來
+        elif event == "bootstrap":
+            if self.is_out_of_order(data):
+                return
+            self.put_changed(data['symbol'], data['fields'])
+            self.stale.discard(data['symbol'])
+
+        # 子行程解析及合併後的更新，[(股票代號, 最後時間, 欄位), ...]
+        # 子行程已先做過去重，只送一次的欄位(參考價、市場別、最早漲停時間)即使價格較舊也要套用
+        elif event == "shard":
+            for symbol, tick_time, fields in data:
+                limit_up_time = fields.pop('limit_up_time', None)
+                fields.pop('limit_up_bucket', None)
+                if tick_time and self.is_out_of_order({'symbol': symbol, 'lastUpdated': tick_time}):
+                    fields = {field: fields[field] for field in SHARD_STICKY_FIELDS if field in fields}
+                else:
+                    self.stale.discard(symbol)
+                if limit_up_time is not None:
+                    # 分組依本行程已知的最早時間重新判斷
+                    fields.update(self.earlier_limit_up(symbol, limit_up_time))
+                if fields:
+                    self.put_changed(symbol, fields)
+
+        # 由一分K回補的最早漲停時間
+        elif event == "backfill":
+            fields = self.earlier_limit_up(data['symbol'], data['limit_up_time'])
+            if fields:
+                self.put_changed(data['symbol'], fields)
+
+    def earlier_limit_up(self, symbol, tick_time):
+        # 只回傳比已知更早的漲停時間及分組，緩衝區合併時才不會被較晚的值蓋掉
+        last = self.last_fields.get(symbol) or {}
+        known = last.get('limit_up_time', 0)
+        if known and tick_time >= known:
+            return {}
+        fields = {'limit_up_time': tick_time}
+        rules = self.time_rules
+        bucket = rules.bucket(tick_time)
+        if bucket < last.get('limit_up_bucket', rules.count):
+            fields['limit_up_bucket'] = bucket
+        return fields
+
+    def is_out_of_order(self, data):
+        # 比已套用的資料還舊(例如較晚回來的REST結果)就不寫入，避免蓋掉較新的tick
+        tick_time = data.get('lastUpdated')
+        if tick_time is None:
+            return False
+        symbol = data['symbol']
+        if tick_time < self.last_time.get(symbol, 0):
+            self.out_of_order += 1
+            return True
+        self.last_time[symbol] = tick_time
+        if self.time_rules.advance(tick_time):
+            self.start_new_day()
+        return False
+
+    def start_new_day(self):
+        # 由解析執行緒呼叫: 前一天的漲停、最早分組及時間不再和今天比較
+        for last in self.last_fields.values():
+            last.pop('limit_up', None)
+            last.pop('limit_up_bucket', None)
+            last.pop('limit_up_time', None)
+        self.day_rolled = True
+        self.log('換日，清除前一天的漲停狀態')
+
+    def put_changed(self, symbol, fields):
+        # 只把和上次送出值不同的欄位放進緩衝區，全部沒變的tick不產生任何畫面更新，回傳是否有放入
+        last = self.last_fields.get(symbol)
+        if last is None:
+            last = self.last_fields[symbol] = {}
+        changed = {}
+        for field, value in fields.items():
+            if field in last and _same_value(last[field], value):
+                continue
+            changed[field] = value
+            last[field] = value
+
+        self.fields_received += len(fields)
+        self.fields_suppressed += len(fields) - len(changed)
+        if changed:
+            self.tick_buffer.put(symbol, changed)
+            return True
+        self.ticks_suppressed += 1
+        return False
+
+    def save_snapshot(self, path=None):
+        # 把目前的看盤狀態寫成資料當天的快照，由使用端定時及結束時呼叫(與apply_pending同一執行緒)
+        board = self.board
+        if not self.snapshots or not board.symbols:
+            return None
+        records = np.zeros(len(board.symbols), dtype=SNAPSHOT_DTYPE)
+        records['symbol'] = board.symbols
+        records['market'] = board.market
+        for field in ('open', 'high', 'low', 'last', 'change', 'reference', 'limit_up', 'limit_up_time'):
+            records[field] = getattr(board, field)
+        last_time = self.last_time
+        records['last_time'] = [last_time.get(symbol, 0) for symbol in board.symbols]
+        day = data_day(records['last_time'])
+        if day is None:
+            # 還沒收到任何帶時間的行情
+            return None
+        path = path or snapshot_path(day)
+        try:
+            write_snapshot(records, path)
+        except OSError as e:
+            self.log(f'看盤快照寫入失敗: {e}')
+            return None
+        return path
+
+    def restore_snapshot(self, path=None):
+        # 以memory map讀取當天的快照，依股票代號寫回BoardData，回傳還原的檔數
+        if not self.snapshots:
+            return 0
+        start = time.perf_counter()
+        records = open_snapshot(path or snapshot_path())
+        if records is None:
+            return 0
+        day = data_day(records['last_time'])
+        if day != datetime.now().date():
+            self.log('看盤快照不是今天的資料({})，不還原'.format(day))
+            return 0
+        board = self.board
+        symbol_idx = board.symbol_idx
+        pairs = [(row, symbol_idx[symbol]) for row, symbol in enumerate(records['symbol'].tolist()) if symbol in symbol_idx]
+        if not pairs:
+            return 0
+        rows, indices = (np.array(column, dtype=np.int64) for column in zip(*pairs))
+        records = records[rows]
+
+        for field in ('open', 'high', 'low', 'last', 'change', 'limit_up', 'limit_up_time'):
+            getattr(board, field)[indices] = records[field]
+        markets = records['market'].tolist()
+        for idx, market in zip(indices.tolist(), markets):
+            board.market[idx] = market
+        references = records['reference']
+        known = ~np.isnan(references)
+        if known.any():
+            board.set_references(indices[known], references[known])
+        # 漲停分組依目前的規則由最早漲停時間重新換算
+        limit_up_times = records['limit_up_time']
+        hit = limit_up_times > 0
+        if hit.any():
+            thresholds = self.time_rules.thresholds_for(int(limit_up_times[hit][0]))
+            board.limit_up_bucket[indices[hit]] = np.searchsorted(thresholds, limit_up_times[hit], side='right')
+
+        # 類股統計及去重用的最後送出值，與還原後的BoardData一致
+        count = self.time_rules.count
+        for row, idx in enumerate(indices.tolist()):
+            symbol = board.symbols[idx]
+            change = float(board.change[idx])
+            limit_up = bool(board.limit_up[idx])
+            bucket = int(board.limit_up_bucket[idx])
+            for sector in self.symbol_sectors[idx]:
+                self.aggregates[sector].update(math.nan, change, False, limit_up, count, bucket)
+            last = {field: float(getattr(board, field)[idx]) for field in ('open', 'high', 'low', 'last', 'change')}
+            last['market'] = markets[row]
+            last['limit_up'] = limit_up
+            if known[row]:
+                last['reference'] = float(references[row])
+            if hit[row]:
+                last['limit_up_time'] = int(limit_up_times[row])
+                last['limit_up_bucket'] = bucket
+            self.last_fields[symbol] = last
+            tick_time = int(records['last_time'][row])
+            if tick_time:
+                self.last_time[symbol] = tick_time
+        self.log('還原看盤快照: {}/{}檔, 耗時{:.1f}ms'.format(len(indices), len(board.symbols), (time.perf_counter()-start)*1000))
+        return len(indices)
+
+    def handle_connect(self):
+        self.log('market data connected')
+        if self.disconnected_at is None:
+            return
+
+        # 斷線後重新連上: 舊的訂閱已失效，一次批次重新訂閱，所有股票先視為可能過時
+        self.log('重新連線成功, 第{}次嘗試, 斷線{:.1f}秒'.format(self.reconnect_attempts, time.perf_counter()-self.disconnected_at))
+        self.disconnected_at = None
+        self.reconnect_attempts = 0
+        self.stale = set(self.board.symbols)
+        if self.subscriptions is not None:
+            self.subscriptions.resubscribe_all()
+        if self.reststock is not None and self.stale:
+            timer = threading.Timer(RESYNC_GRACE, self.resync_stale)
+            timer.daemon = True
+            timer.start()
+
+    def handle_disconnect(self, code, message):
+        self.log(f'market data disconnect: {code}, {message}')
+        if self.user_disconnect:
+            return
+        if self.disconnected_at is None:
+            self.disconnected_at = time.perf_counter()
+        if self.reconnect_thread is None or not self.reconnect_thread.is_alive():
+            self.reconnect_thread = threading.Thread(target=self._reconnect_loop, name='Reconnect', daemon=True)
+            self.reconnect_thread.start()
+
+    def _reconnect_loop(self):
+        while not self.reconnect_stop.is_set() and not self.user_disconnect:
+            delay = min(RECONNECT_MAX, RECONNECT_BASE * 2 ** self.reconnect_attempts) * random.uniform(0.5, 1.0)
+            self.reconnect_attempts += 1
+            self.log('{:.1f}秒後重新連線(第{}次)'.format(delay, self.reconnect_attempts))
+            if self.reconnect_stop.wait(delay):
+                return
+            try:
+                self.websocket.connect()
+                return
+            except Exception as e:
+                self.log(f'重新連線失敗: {e}')
+
+    def resync_stale(self):
+        # 重新訂閱後仍未收到行情的股票，用REST查詢最新報價補齊
+        symbols = list(self.stale)
+        if not symbols or self.user_disconnect:
+            return
+        start = time.perf_counter()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=RESYNC_WORKERS, thread_name_prefix='Resync') as pool:
+            for symbol, quote in zip(symbols, pool.map(self._fetch_quote, symbols)):
+                if quote is None:
+                    failed += 1
+                elif symbol in self.stale:
+                    # 等待查詢期間若已收到websocket行情，以websocket為準
+                    self.decode_worker.submit_event('snapshot', quote)
+        self.log('重新同步{}檔, 失敗{}檔, 耗時{:.0f}ms'.format(len(symbols), failed, (time.perf_counter()-start)*1000))
+
+    def bootstrap(self):
+        # 依市場別平行查詢整個市場的快照，只取觀察清單內的股票
+        board = self.board
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=BOOTSTRAP_WORKERS, thread_name_prefix='Bootstrap') as pool:
+            results = list(zip(BOOTSTRAP_MARKETS, pool.map(self._fetch_snapshot, BOOTSTRAP_MARKETS)))
+
+        count = 0
+        limit_up_cents = {}
+        for market, quotes in results:
+            quotes = [quote for quote in quotes if quote.get('symbol') in board.symbol_idx and quote.get('closePrice') is not None]
+            if not quotes:
+                continue
+            # 快照沒有參考價及漲停旗標: 參考價=收盤價-漲跌，漲停與否以漲停價判斷，整批一次計算
+            indices = np.array([board.symbol_idx[quote['symbol']] for quote in quotes])
+            close = np.array([quote['closePrice'] for quote in quotes], dtype=np.float64)
+            reference = np.round(close - np.array([quote.get('change', 0) for quote in quotes], dtype=np.float64), 2)
+            limit_up_price, _ = limit_prices(to_cents(reference), board.etf[indices])
+            limit_up = to_cents(close) >= limit_up_price
+            limit_up_cents.update(zip((quote['symbol'] for quote in quotes), limit_up_price.tolist()))
+
+            for quote, ref, is_limit_up in zip(quotes, reference.tolist(), limit_up.tolist()):
+                fields = {
+                    'market': market,
+                    'open': quote.get('openPrice', math.nan),
+                    'high': quote.get('highPrice', math.nan),
+                    'low': quote.get('lowPrice', math.nan),
+                    'last': quote['closePrice'],
+                    'change': quote.get('changePercent', math.nan),
+                    'reference': ref,
+                    'limit_up': is_limit_up,
+                }
+                self.decode_worker.submit_event('bootstrap', {'symbol': quote['symbol'], 'lastUpdated': quote.get('lastUpdated'), 'fields': fields})
+            count += len(quotes)
+        self.log('快照初始化: {}/{}檔, 耗時{:.0f}ms'.format(count, len(board.symbols), (time.perf_counter()-start)*1000))
+        if limit_up_cents and not self.user_disconnect:
+            self.backfill(limit_up_cents)
+
+    def backfill(self, limit_up_cents):
+        # 盤中才啟動時，用當天一分K找出每檔最早觸及漲停價的時間，補回各時間分組的漲停標記
+        now = int(time.time()*1000000)
+        candles = CandleBackfill(self.reststock, self.log).load(list(limit_up_cents), self.time_rules.latest_passed(now))
+        found = 0
+        for symbol, (times, highs) in candles.items():
+            hit = np.flatnonzero(to_cents(highs) >= limit_up_cents[symbol])
+            if len(hit):
+                # 一分K的時間為該分鐘開始，門檻都在整分，所以以開始時間判斷分組即正確
+                self.decode_worker.submit_event('backfill', {'symbol': symbol, 'limit_up_time': int(times[hit[0]])})
+                found += 1
+        self.log('一分K回補: {}檔盤中曾觸及漲停'.format(found))
+
+    def _fetch_snapshot(self, market):
+        try:
+            return self.reststock.snapshot.quotes(market=market).get('data') or []
+        except Exception as e:
+            self.log(f'查詢{market}快照失敗: {e}')
+            return []
+
+    def _fetch_quote(self, symbol):
+        try:
+            quote = self.reststock.intraday.quote(symbol=symbol)
+            return quote if quote and 'changePercent' in quote else None
+        except Exception as e:
+            self.log(f'查詢{symbol}報價失敗: {e}')
+            return None
+
+    def disconnect(self):
+        # 使用者主動斷線，不觸發重連
+        self.user_disconnect = True
+        self.reconnect_stop.set()
+        if self.websocket is not None:
+            self.websocket.disconnect()
+        if self.shards is not None:
+            self.shards.stop()
+
+    def handle_error(self, error):
+        self.log(f'market data error: {error}')
+
+    def apply_pending(self):
+        # 把緩衝區內每檔最新的欄位寫進BoardData，回傳[(股票索引, first_col, last_col), ...]
+        if self.subscriptions is not None:
+            self.subscriptions.check_timeouts()
+        pending = self.tick_buffer.drain()
+        changes = []
+        board = self.board
+
+        if self.day_rolled:
+            self.day_rolled = False
+            for idx in board.reset_day().tolist():
+                changes.append((idx, CHANGE_COL, BUCKET_LAST_COL))
+            for aggregate in self.aggregates.values():
+                aggregate.reset_day()
+
+        # 新的參考價整批一次計算漲跌停價
+        ref_indices = []
+        ref_values = []
+        for symbol, fields in pending.items():
+            reference = fields.get('reference')
+            idx = board.symbol_idx.get(symbol)
+            if reference is not None and idx is not None and not _same_value(board.reference[idx], reference):
+                ref_indices.append(idx)
+                ref_values.append(reference)
+        if ref_indices:
+            board.set_references(ref_indices, ref_values)
+        ref_changed = set(ref_indices)
+
+        for symbol, fields in pending.items():
+            idx = board.symbol_idx.get(symbol)
+            if idx is None:
+                continue
+            old_change = float(board.change[idx])
+            was_limit_up = board.limit_up[idx]
+            was_bucket = int(board.limit_up_bucket[idx])
+            first_col, last_col = board.apply(idx, fields)
+            if idx in ref_changed:
+                first_col = min(first_col, TICKS_COL)
+                last_col = max(last_col, TICKS_COL)
+            if last_col < 0:
+                # 緩衝期間來回變動後又回到原值
+                continue
+            changes.append((idx, first_col, last_col))
+
+            new_change = float(board.change[idx])
+            is_limit_up = board.limit_up[idx]
+            is_bucket = int(board.limit_up_bucket[idx])
+            if not _same_value(old_change, new_change) or was_limit_up != is_limit_up or was_bucket != is_bucket:
+                for sector in self.symbol_sectors[idx]:
+                    self.aggregates[sector].update(old_change, new_change, was_limit_up, is_limit_up, was_bucket, is_bucket)
+
+            if is_limit_up and not was_limit_up:
+                for callback in self.limit_up_listeners:
+                    callback(idx)
+
+        if self.metrics is not None:
+            self.last_applied = self.metrics.on_applied(pending)
+        return changes
+
+    def sector_ranking(self, sector, top=None, by='change'):
+        # 類股內依漲幅由大到小(by='ticks'時依距漲停檔數由小到大)的股票索引，尚無資料的排在最後
+        indices = np.asarray(self.sectors[sector], dtype=np.int64)
+        if by == 'ticks':
+            ticks = self.board.ticks_to_limit[indices]
+            order = np.argsort(np.where(ticks < 0, np.iinfo(np.int64).max, ticks), kind='stable')
+        else:
+            change = self.board.change[indices]
+            order = np.argsort(-np.where(np.isnan(change), -np.inf, change), kind='stable')
+        ranked = indices[order]
+        return ranked if top is None else ranked[:top]
+
+    def symbol_record(self, idx):
+        board = self.board
+        return {
+            'symbol': board.symbols[idx],
+            'name': board.names[idx],
+            'market': board.market[idx],
+            'open': _json_float(board.open[idx]),
+            'high': _json_float(board.high[idx]),
+            'low': _json_float(board.low[idx]),
+            'last': _json_float(board.last[idx]),
+            'change': _json_float(board.change[idx]),
+            'limit_up': bool(board.limit_up[idx]),
+            'limit_up_price': _cents_to_price(board.limit_up_price[idx]),
+            'limit_down_price': _cents_to_price(board.limit_down_price[idx]),
+            'ticks_to_limit': int(board.ticks_to_limit[idx]) if board.ticks_to_limit[idx] >= 0 else None,
+            'limit_up_by': self.time_rules.label_of(board.limit_up_bucket[idx]),
+        }
+
+    @property
+    def suppressed_ratio(self):
+        return self.fields_suppressed / self.fields_received if self.fields_received else 0.0
+
+    def stats_lines(self):
+        stats = self.decode_worker.stats()
+        lines = ["解析統計: 收到{}筆, 預先篩除{}筆, 解析{}筆, 佇列滿丟棄{}筆, 處理錯誤{}筆".format(
+            stats['submitted'], stats['rejected'], stats['decoded'], stats['dropped'], stats['errors'])]
+        stats = self.tick_buffer.stats()
+        lines.append("tick統計: 收到{}筆, 合併{}筆, 實際更新{}筆".format(stats['received'], stats['conflated'], stats['flushed']))
+        lines.append("欄位去重: 收到{}個欄位, 未變動略過{}個({:.1%}), 整筆略過{}筆, 較舊資料略過{}筆".format(
+            self.fields_received, self.fields_suppressed, self.suppressed_ratio, self.ticks_suppressed, self.out_of_order))
+        if self.subscriptions is not None:
+            stats = self.subscriptions.stats()
+            lines.append("訂閱統計: {}檔, 已確認{}檔, 等待中{}檔, 失敗{}檔, 請求{}次, 重送{}檔, {}".format(
+                stats['symbols'], stats['acked'], stats['pending'], stats['failed'], stats['requests'], stats['retries'],
+                self.subscriptions.latency_text()))
+        if self.shards is not None:
+            lines.append(self.shards.stats_text())
+        return lines
+
+    def toggle_profiler(self):
+        # 回傳切換後是否正在分析，停止後再開啟會累積在同一份結果
+        if self.profiler is None:
+            self.profiler = SamplingProfiler()
+        if self.profiler.running:
+            self.profiler.stop()
+            self.log("效能分析已停止，取樣{}次".format(self.profiler.samples))
+        else:
+            self.profiler.start()
+            self.log("效能分析已開始{:g}秒".format(self.profiler.seconds))
+        return self.profiler.running
+
+    def close(self):
+        if self.replay_thread is not None:
+            self.replay_stop.set()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.decode_worker.stop()
+        path = self.save_snapshot()
+        if path is not None:
+            self.log("看盤快照已寫入: {}".format(path))
+        if self.metrics is not None:
+            prom_path, csv_path = self.metrics.export()
+            self.log("延遲統計已輸出: {}, {}".format(prom_path, csv_path))
+        if self.profiler is not None:
+            paths = self.profiler.dump()
+            if paths:
+                self.log("效能分析已輸出: {}".format(', '.join(str(path) for path in paths)))
+
+
+def _json_float(value):
+    return None if math.isnan(value) else round(float(value), 2)
+
+
+def _cents_to_price(cents):
+    return None if cents < 0 else int(cents) / 100
+
+
+# ---- 常駐模式的輸出 ----
+
+class StdoutSink:
+    def write(self, event):
+        if event['type'] == 'limit_up':
+            print('{time} 漲停 {symbol} {name} {last} {change}% 類股:{sector_names}{mark}'.format(
+                mark=' ({})'.format(event['limit_up_by']) if event['limit_up_by'] else '', sector_names=','.join(event['sectors']), **event), flush=True)
+        else:
+            rows = ' '.join('{}{}({}%)'.format(r['symbol'], r['name'], r['change']) for r in event['rows'])
+            summary = event['summary']
+            by = ' '.join('{}{}'.format(label, count) for label, count in summary['limit_up_by'].items())
+            print('{} [{}] 漲停{} {} 漲{}跌{} 平均{}% 中位數{}% | {}'.format(
+                event['time'], event['sector'], summary['limit_up'], by, summary['advancers'],
+                summary['decliners'], summary['mean_change'], summary['median_change'], rows), flush=True)
+
+    def close(self):
+        pass
+
+
+class CsvSink:
+    FIELDS = ['time', 'type', 'sector', 'rank', 'symbol', 'name', 'market', 'open', 'high', 'low', 'last', 'change', 'ticks_to_limit', 'limit_up', 'limit_up_by']
+
+    def __init__(self, path):
+        new_file = not Path(path).is_file()
+        self.file = open(path, 'a', newline='', encoding='utf-8-sig')
+        self.writer = csv.DictWriter(self.file, self.FIELDS, extrasaction='ignore')
+        if new_file:
+            self.writer.writeheader()
+
+    def write(self, event):
+        if event['type'] == 'limit_up':
+            self.writer.writerow(dict(event, sector=','.join(event['sectors'])))
+        else:
+            for rank, row in enumerate(event['rows'], 1):
+                self.writer.writerow(dict(row, time=event['time'], type='board', sector=event['sector'], rank=rank))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SocketSink:
+    """TCP伺服器，每個事件以一行JSON送給所有連上的client"""
+    def __init__(self, host, port):
+        self.server = socket.create_server((host, port))
+        self.clients = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self._accept, name='SocketSink', daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.clients.append(conn)
+
+    def write(self, event):
+        line = (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+        with self.lock:
+            for conn in list(self.clients):
+                try:
+                    conn.sendall(line)
+                except OSError:
+                    self.clients.remove(conn)
+                    conn.close()
+
+    def close(self):
+        self.server.close()
+        with self.lock:
+            for conn in self.clients:
+                conn.close()
+
+
+def make_sink(spec):
+    if spec == '-':
+        return StdoutSink()
+    kind, _, target = spec.partition(':')
+    if kind == 'csv':
+        return CsvSink(target)
+    if kind == 'tcp':
+        host, _, port = target.rpartition(':')
+        return SocketSink(host or '0.0.0.0', int(port))
+    raise ValueError('unknown output: ' + spec)
+
+
+def _login(sdk):
+    # 使用登入視窗存下的帳號資訊
+    with open('info.pkl', 'rb') as f:
+        user_info_dict = pickle.load(f)
+    accounts = sdk.login(user_info_dict['id'], user_info_dict['pwd'], Path(user_info_dict['cert_path']).__str__(), user_info_dict['cert_pwd'])
+    if not accounts.is_success:
+        raise RuntimeError(accounts.message)
+    for cur_account in accounts.data:
+        if cur_account.account == user_info_dict['target_account']:
+            return cur_account
+    raise RuntimeError('找不到帳號 {}'.format(user_info_dict['target_account']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='漲停看盤常駐程式(不開視窗)')
+    parser.add_argument('--list', required=True, help='類股清單Excel路徑')
+    parser.add_argument('--output', action='append', help="輸出目的地: '-'(stdout)、csv:路徑、tcp:host:port，可重複指定")
+    parser.add_argument('--board-interval', type=float, default=60, help='輸出類股排行的間隔秒數，0為不輸出')
+    parser.add_argument('--top', type=int, default=10, help='每個類股輸出前幾名')
+    parser.add_argument('--rank-by', choices=['change', 'ticks'], default='change', help='類股排行依漲幅或距漲停檔數')
+    parser.add_argument('--flush-hz', type=float, default=10, help='每秒處理緩衝區的次數')
+    parser.add_argument('--shards', type=int, default=int(os.environ.get(SHARDS_ENV) or 0), help='分片接收的子行程數，0為不分片')
+    parser.add_argument('--fake-url', default=os.environ.get('FAKE_MARKET_URL'), help='改連本機假行情伺服器')
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr, flush=True)
+
+    if args.fake_url:
+        from fake_market import FakeSDK
+        sdk = FakeSDK(args.fake_url)
+    else:
+        from fubon_neo.sdk import FubonSDK, Mode
+        sdk = FubonSDK()
+        account = _login(sdk)
+        log("login success, 現在使用帳號: {}".format(account.account))
+    sdk.init_realtime(None if args.fake_url else Mode.Normal)
+
+    sinks = [make_sink(spec) for spec in (args.output or ['-'])]
+
+    def emit(event):
+        for sink in sinks:
+            sink.write(event)
+
+    engine = LimitUpEngine(log=log, snapshots=not args.fake_url)
+
+    def on_limit_up(idx):
+        emit(dict(engine.symbol_record(idx), type='limit_up', time=datetime.now().isoformat(timespec='seconds'), sectors=engine.symbol_sectors[idx]))
+
+    engine.on_limit_up(on_limit_up)
+    if args.shards > 0:
+        engine.attach_shards(ShardedIngest(args.shards, args.fake_url), sdk.marketdata.rest_client.stock)
+    else:
+        engine.attach(sdk.marketdata.websocket_client.stock, sdk.marketdata.rest_client.stock)
+        engine.websocket.connect()
+    engine.load_sectors(read_sectors(args.list))
+
+    next_board = time.monotonic() + args.board_interval
+    next_snapshot = time.monotonic() + SNAPSHOT_INTERVAL
+    try:
+        while True:
+            time.sleep(1 / args.flush_hz)
+            engine.apply_pending()
+            if time.monotonic() >= next_snapshot:
+                next_snapshot += SNAPSHOT_INTERVAL
+                engine.save_snapshot()
+            if args.board_interval and time.monotonic() >= next_board:
+                next_board += args.board_interval
+                now = datetime.now().isoformat(timespec='seconds')
+                for sector in engine.sectors:
+                    rows = [engine.symbol_record(idx) for idx in engine.sector_ranking(sector, args.top, args.rank_by)]
+                    emit({'type': 'board', 'time': now, 'sector': sector, 'summary': engine.aggregates[sector].record(), 'rows': rows})
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for line in engine.stats_lines():
+            log(line)
+        engine.disconnect()
+        sdk.logout()
+        engine.close()
+        for sink in sinks:
+            sink.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
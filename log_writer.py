@@ -0,0 +1,59 @@
+import logging
+import queue
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+
+# 完整log檔，超過LOG_MAX_BYTES時輪替，保留LOG_BACKUPS個舊檔
+LOG_PATH = Path('./logs/market_watch.log')
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 5
+# 畫面上最多保留的log行數
+LOG_PANEL_LINES = 2000
+
+
+class LogBuffer:
+    """任何執行緒都可以呼叫write，畫面端定時drain後一次寫進log面板
+
+    待顯示的行數上限與面板相同，來不及顯示的舊訊息直接捨棄(完整內容在log檔)。
+    deque的append及popleft本身是執行緒安全的，drain只由畫面執行緒呼叫，不需要另外加鎖
+    """
+    def __init__(self, maxlen=LOG_PANEL_LINES):
+        self.pending = deque(maxlen=maxlen)
+
+    def write(self, message):
+        self.pending.append(message)
+
+    def drain(self):
+        lines = []
+        pending = self.pending
+        while pending:
+            lines.append(pending.popleft())
+        return lines
+
+
+class AsyncFileLog:
+    """log檔由QueueListener的背景執行緒寫入，write只把訊息放進佇列"""
+    def __init__(self, path=LOG_PATH, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter('%(asctime)s %(threadName)s %(message)s'))
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, self.handler)
+
+        self.logger = logging.getLogger('market_watch')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.queue_handler = QueueHandler(self.queue)
+        self.logger.addHandler(self.queue_handler)
+        self.listener.start()
+
+    def write(self, message):
+        self.logger.info(message)
+
+    def close(self):
+        # 等背景執行緒寫完佇列內剩下的訊息
+        self.logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        self.handler.close()
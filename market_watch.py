@@ -1,59 +1,30 @@
 from login_gui import LoginForm
-
+from limit_up_engine import LimitUpEngine, INFO_HEADER, TIME_RULES
+from watch_list import read_sectors
+from fake_market import FakeSDK, FAKE_URL_ENV
+from board_model import SectorTableModel, format_price
+from metrics_panel import MetricsPanel, PaintFilter
+from board_snapshot import SNAPSHOT_INTERVAL
+from log_writer import AsyncFileLog, LogBuffer, LOG_PANEL_LINES
+from shard_ingest import ShardedIngest
+
+import os
 import sys
-import json
-import math
 from fubon_neo.sdk import FubonSDK, Mode
-import pandas as pd
 from pathlib import Path
 import pickle
-from datetime import datetime
-
-from PySide6.QtWidgets import QTabWidget, QTableWidgetItem, QFileDialog, QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QGridLayout, QLabel, QLineEdit, QPushButton, QSizePolicy, QPlainTextEdit
-from PySide6.QtGui import QIcon, QTextCursor, QColor
-from PySide6.QtCore import Qt, Signal, QObject, QSize
-
-
-class NumericTableWidgetItem(QTableWidgetItem):
-    def __init__(self, value):
-        super().__init__(str(value))
-        self.value = self._convert_to_number(value)
-
-    def _convert_to_number(self, value):
-        if isinstance(value, (int, float)):
-            return float(value)
-        if isinstance(value, str):
-            # 處理百分比
-            if value.strip() in ['-', '', 'N/A']:
-                return float('-inf')  # 使用負無窮大表示這些特殊值
-            
-            if value.endswith('%'):
-                try:
-                    return float(value.rstrip('%')) / 100
-                except ValueError:
-                    pass
-            # 處理普通數字
-            try:
-                return float(value.replace(',', ''))  # 處理千位分隔符
-            except ValueError:
-                pass
-        return value
-
-    def __lt__(self, other):
-        if isinstance(other, NumericTableWidgetItem):
-            if isinstance(self.value, (int, float)) and isinstance(other.value, (int, float)):
-                return self.value < other.value
-        return super().__lt__(other)
-
-    def setText(self, text):
-        super().setText(text)
-        self.value = self._convert_to_number(text)
-
-class Communicate(QObject):
-    # 定義一個帶參數的信號
-    print_log_signal = Signal(str)
-    table_update_signal = Signal(str, str, int, str)
-    color_update_signal = Signal(str, str, bool)
+
+from PySide6.QtWidgets import QTabWidget, QFileDialog, QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QTableView, QGridLayout, QLabel, QLineEdit, QPushButton, QSizePolicy, QPlainTextEdit
+from PySide6.QtGui import QIcon, QTextCursor, QKeySequence, QShortcut
+from PySide6.QtCore import Qt, QSize, QTimer
+
+# 表格刷新頻率(Hz)，websocket收到的tick先進緩衝區，由QTimer依此頻率批次更新到表格
+FLUSH_HZ = 20
+# 類股統計(分頁標題及總覽分頁)刷新頻率(Hz)，統計值隨tick即時維護，這裡只控制重繪頻率
+SUMMARY_HZ = 1
+# log面板一次寫入累積訊息的頻率(Hz)
+LOG_FLUSH_HZ = 4
+SUMMARY_HEADER = ['類股名稱', '檔數', '漲停家數'] + TIME_RULES.labels + ['上漲家數', '下跌家數', '平均漲幅(%)', '漲幅中位數(%)']
 
 class MainApp(QWidget):
     def __init__(self, active_account):
@@ -71,7 +42,7 @@ class MainApp(QWidget):
         layout = QVBoxLayout()
 
         # 庫存表表頭
-        self.info_header = ['股票名稱', '股票代號', '市場別', '開盤價','最高價','最低價', '現價', '漲幅(%)', '9:40前漲停']
+        self.info_header = INFO_HEADER
         
         self.info_tab = QTabWidget()
         table = QTableWidget(0, len(self.info_header))
@@ -106,6 +77,13 @@ class MainApp(QWidget):
         
         self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
+        # 面板只保留最近的log，完整內容由背景執行緒寫進輪替的log檔
+        self.log_text.setMaximumBlockCount(LOG_PANEL_LINES)
+        self.log_buffer = LogBuffer()
+        self.file_log = AsyncFileLog()
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(int(1000/LOG_FLUSH_HZ))
 
         layout.addWidget(self.info_tab)
         layout.addLayout(layout_parameter)
@@ -139,229 +117,159 @@ class MainApp(QWidget):
         self.folder_btn.clicked.connect(self.showDialog)
         self.read_excel_btn.clicked.connect(self.read_watch_list)
 
-        # communicator slot function
-        self.communicator = Communicate()
-        self.communicator.print_log_signal.connect(self.print_log)
-        self.communicator.table_update_signal.connect(self.update_table)
-        self.communicator.color_update_signal.connect(self.limit_up_coloring)
-
-        # default parameter initilaize
-        self.subscribed_ids = {}
-        self.col_idx_map = dict(zip(self.info_header, range(len(self.info_header))))
-        threshold_time = datetime.today().replace(hour=9, minute=40, second=0, microsecond=0)
-        self.threshold_unix = int(datetime.timestamp(threshold_time)*1000000)
-
-        # websocket connect
-        self.websocket.on("message", self.handle_message)
-        self.websocket.on("connect", self.handle_connect)
-        self.websocket.on("disconnect", self.handle_disconnect)
-        self.websocket.on("error", self.handle_error)
-        self.websocket.connect()
-
-    def limit_up_coloring(self, table_name, symbol, is_limit_up):
-        if is_limit_up:
-            self.table_name_maps[table_name].item(self.row_symbol_maps[table_name][symbol], self.col_idx_map['漲幅(%)']).setBackground(QColor(Qt.red))
-            self.table_name_maps[table_name].item(self.row_symbol_maps[table_name][symbol], self.col_idx_map['漲幅(%)']).setForeground(QColor(Qt.white))
+        # 行情接收、解析及漲停狀態由引擎處理，視窗只負責顯示，print_log可由任何執行緒呼叫
+        # 看盤快照只在連實際行情(FubonSDK)時寫入及還原
+        self.engine = LimitUpEngine(log=self.print_log, snapshots=isinstance(sdk, FubonSDK))
+        self.table_name_maps = {}
+        self.table_view_maps = {}
+        self.sector_tabs = []
+        self.current_model = None
+        self.summary_table = None
+        self.summary_dirty = False
+
+        # 定時把引擎緩衝區的tick更新到表格
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(self.flush_ticks)
+        self.flush_timer.start(int(1000/FLUSH_HZ))
+
+        # 較低頻率更新類股統計
+        self.summary_timer = QTimer(self)
+        self.summary_timer.timeout.connect(self.refresh_summary)
+        self.summary_timer.start(int(1000/SUMMARY_HZ))
+
+        # 定時寫入看盤快照，盤中重新啟動時可還原
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.timeout.connect(self.engine.save_snapshot)
+        self.snapshot_timer.start(SNAPSHOT_INTERVAL*1000)
+
+        # 分頁切換時才建立或更新該類股表格
+        self.info_tab.currentChanged.connect(self.tab_changed)
+
+        # 開啟延遲統計時，F9顯示各階段延遲分布
+        self.metrics_panel = None
+        self.paint_filter = None
+        if self.engine.metrics is not None:
+            self.metrics_panel = MetricsPanel(self.engine.metrics)
+            self.paint_filter = PaintFilter(self.engine.metrics, self)
+            QShortcut(QKeySequence('F9'), self, self.toggle_metrics_panel)
+            self.print_log("按F9顯示延遲統計")
+
+        # F10開始/停止效能分析，關閉視窗時輸出結果
+        QShortcut(QKeySequence('F10'), self, self.engine.toggle_profiler)
+
+        # 設定MARKET_SHARDS時由多個子行程分片接收行情，否則使用本行程的websocket
+        shards = ShardedIngest.from_env(os.environ.get(FAKE_URL_ENV))
+        if shards is not None:
+            self.engine.attach_shards(shards, self.reststock)
         else:
-            self.table_name_maps[table_name].item(self.row_symbol_maps[table_name][symbol], self.col_idx_map['漲幅(%)']).setBackground(QColor(Qt.transparent))
-            self.table_name_maps[table_name].item(self.row_symbol_maps[table_name][symbol], self.col_idx_map['漲幅(%)']).setForeground(QColor())
+            # websocket connect
+            self.engine.attach(self.websocket, self.reststock)
+            self.websocket.connect()
+
+    # QTimer定時把緩衝區內每檔最新的欄位一次寫進表格
+    def flush_ticks(self):
+        changes = self.engine.apply_pending()
+        if changes:
+            self.summary_dirty = True
+
+        # 只有目前顯示的類股表格即時更新，其他類股的資料留在BoardData，切換分頁時再一次更新
+        model = self.current_model
+        if model is None:
+            return
+        row_of = model.row_of
+        for idx, first_col, last_col in changes:
+            if idx in row_of:
+                model.row_changed(idx, first_col, last_col)
+
+        # 視窗縮小或隱藏時不會重繪，不等待
+        metrics = self.engine.metrics
+        if metrics is not None and self.isVisible() and not self.isMinimized():
+            symbols = self.engine.board.symbols
+            last_applied = self.engine.last_applied
+            metrics.await_paint([last_applied[symbols[idx]] for idx, _, _ in changes if idx in row_of and symbols[idx] in last_applied])
+
+    def toggle_metrics_panel(self):
+        self.metrics_panel.setVisible(not self.metrics_panel.isVisible())
+
+    # 第0頁為類股總覽，第1頁起依序為各類股
+    def tab_changed(self, index):
+        self.current_model = None
+        if index == 0:
+            self.summary_dirty = True
+            self.refresh_summary()
+            return
+        if not 0 < index <= len(self.sector_tabs):
+            return
 
-    def update_table(self, table_name, symbol, col, value):
-        try:
-            table = self.table_name_maps[table_name]
-            table.item(self.row_symbol_maps[table_name][symbol], col).setText(value)
-            if col == self.col_idx_map['漲幅(%)']:
-                table.sortByColumn(col, Qt.DescendingOrder)
-                symbol_list = []
-                for i in range(table.rowCount()):
-                    symbol_list.append(table.item(i, self.col_idx_map['股票代號']).text())
-                self.row_symbol_maps[table_name] = dict(zip(symbol_list, range(len(symbol_list))))
-        except Exception as e:
-            print(e, self.row_symbol_maps[table_name][symbol], col, value)
-
-
-    def handle_message(self, message):
-        msg = json.loads(message)
-        event = msg["event"]
-        data = msg["data"]
-        # print(event, data)
-        
-        # subscribed事件處理
-        if event == "subscribed":
-            if type(data) == list:
-                # print(event, data)
-                for sub_record in data:
-                    self.communicator.print_log_signal.emit('訂閱成功...'+sub_record['symbol'])
-                    self.subscribed_ids[sub_record['symbol']] = sub_record['id']
-            else:
-                id = data["id"]
-                symbol = data["symbol"]
-                self.communicator.print_log_signal.emit('訂閱成功...'+symbol)
-                self.subscribed_ids[symbol] = id
-        
-        # subscribed事件處理
-        elif event == "unsubscribed":
-            if type(data) == list:
-                print(event, data)
-            else:
-                id = data["id"]
-                symbol = data["symbol"]
-                self.communicator.print_log_signal.emit('訂閱成功...'+symbol)
-                self.subscribed_ids[symbol] = id
-
-        # subscribed事件處理
-        elif event == "snapshot":
-            # print(event, data)
-            symbol = data['symbol']
-            market_type = data['market']
-            
-            if 'openPrice' in data:
-                open_price = data['openPrice']
-            else:
-                open_price = '-'
-            
-            if 'highPrice' in data:
-                high_price = data['highPrice']
-            else:
-                high_price = '-'
-            
-            if 'lowPrice' in data:
-                low_price = data['lowPrice']
-            else:
-                low_price = '-'
-
-            if 'lastPrice' in data:
-                cur_price = data['lastPrice']
-            else:
-                cur_price = '-'
-
-            change_percent = data['changePercent']
-
-            for name in self.table_name_maps.keys():
-                # print(name)
-                if symbol in self.row_symbol_maps[name]:
-                    if 'isLimitUpPrice' in data:
-                        if data['isLimitUpPrice']:
-                            self.communicator.color_update_signal.emit(name, symbol, data['isLimitUpPrice'])
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['市場別'], str(market_type))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['開盤價'], str(open_price))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['最高價'], str(high_price))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['最低價'], str(low_price))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['現價'], str(cur_price))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['漲幅(%)'], str(change_percent)+'%')
-
-        elif event == "data":
-            # print(event, data)
-            if 'isTrial' in data:
-                if data['isTrial']:
-                    return
-                
-            symbol = data['symbol']
-
-            if 'openPrice' in data:
-                open_price = data['openPrice']
-            else:
-                open_price = '-'
-            
-            if 'highPrice' in data:
-                high_price = data['highPrice']
-            else:
-                high_price = '-'
-            
-            if 'lowPrice' in data:
-                low_price = data['lowPrice']
-            else:
-                low_price = '-'
-
-            if 'lastPrice' in data:
-                cur_price = data['lastPrice']
-            else:
-                cur_price = '-'
-
-            if 'changePercent' in data:
-                change_percent = data['changePercent']
-            else:
-                change_percent = '-'
-            
-            if 'lastUpdated' in data:
-                tick_time = data['lastUpdated']
-            else:
-                tick_time = self.threshold_unix+1
-            
-
-            for name in self.table_name_maps.keys():
-                # print(name)
-                if symbol in self.row_symbol_maps[name]:
-                    if 'isLimitUpPrice' in data:
-                        if data['isLimitUpPrice']:
-                            if tick_time<self.threshold_unix:
-                                self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['9:40前漲停'], 'Y')
-                            self.communicator.color_update_signal.emit(name, symbol, data['isLimitUpPrice'])
-                        else:
-                            self.communicator.color_update_signal.emit(name, symbol, False)
-
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['開盤價'], str(open_price))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['最高價'], str(high_price))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['最低價'], str(low_price))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['現價'], str(cur_price))
-                    self.communicator.table_update_signal.emit(name, symbol, self.col_idx_map['漲幅(%)'], str(change_percent)+'%')
-
-    def handle_connect(self):
-        self.communicator.print_log_signal.emit('market data connected')
-    
-    def handle_disconnect(self, code, message):
-        self.communicator.print_log_signal.emit(f'market data disconnect: {code}, {message}')
-    
-    def handle_error(self, error):
-        self.communicator.print_log_signal.emit(f'market data error: {error}')
+        col_name = self.sector_tabs[index-1]
+        model = self.table_name_maps.get(col_name)
+        if model is None:
+            # 第一次顯示才建立表格
+            model = SectorTableModel(self.engine.board, self.engine.sectors[col_name], self)
+            table = QTableView()
+            table.setModel(model)
+            # 點選漲幅或距漲停表頭切換排序
+            table.horizontalHeader().sectionClicked.connect(model.set_sort_column)
+            if self.paint_filter is not None:
+                table.viewport().installEventFilter(self.paint_filter)
+            self.info_tab.widget(index).layout().addWidget(table)
+            self.table_name_maps[col_name] = model
+            self.table_view_maps[col_name] = table
+        else:
+            model.refresh()
+        self.current_model = model
+
+    # 依引擎維護的類股統計更新分頁標題及總覽分頁，沒有新tick時不重繪
+    def refresh_summary(self):
+        if not self.summary_dirty or self.summary_table is None:
+            return
+        self.summary_dirty = False
+        # 總覽表只在顯示時更新，切回總覽分頁時會再呼叫一次
+        summary_visible = self.info_tab.currentIndex() == 0
+
+        for row, aggregate in enumerate(self.engine.aggregates.values()):
+            # 總覽分頁在第0頁，類股分頁依序在後
+            self.info_tab.setTabText(row+1, '{} 漲停{} ▲{} ▼{}'.format(aggregate.name, aggregate.limit_up, aggregate.advancers, aggregate.decliners))
+            if not summary_visible:
+                continue
+            values = ([aggregate.size, aggregate.limit_up] + [aggregate.limit_up_by(k) for k in range(TIME_RULES.count)]
+                      + [aggregate.advancers, aggregate.decliners, format_price(aggregate.mean), format_price(aggregate.median)])
+            for col, value in enumerate(values, start=1):
+                self.summary_table.item(row, col).setText(str(value))
 
     def read_watch_list(self):
         file_path = self.lineEdit_default_file_path.text()
         if file_path == '':
             return
-        watch_df = pd.read_excel(file_path)
-        self.column_names = [col_name for col_name in watch_df.columns if 'Unnamed' not in col_name]
-        self.table_dict = {}
+        self.load_sectors(read_sectors(file_path))
+
+    # 依{類股名稱: [(股票代號, 股票名稱), ...]}建立各類股表格並訂閱行情
+    def load_sectors(self, sectors):
+        self.engine.load_sectors(sectors)
         self.table_name_maps = {}
-        self.row_symbol_maps = {}
-
-        for i, col_name in enumerate(self.column_names):
-            self.table_dict[col_name] = watch_df.iloc[:, (2*i):(2*i+2)]
-            self.table_dict[col_name].columns = ['代碼', '名稱']
-            self.table_dict[col_name] = self.table_dict[col_name].iloc[1:, :]
-            self.table_dict[col_name] = self.table_dict[col_name].dropna(axis=0, how = 'all')
-            self.table_dict[col_name] = self.table_dict[col_name].reset_index(drop=True)
-
-            rows = self.table_dict[col_name].shape[0]
-            cols = len(self.info_header)
-            table = QTableWidget(rows, cols)
-            table.setHorizontalHeaderLabels(self.info_header)
-
-            self.table_name_maps[col_name] = table
-            self.row_symbol_maps[col_name] = {}
-
-            # ['股票名稱', '股票代號', '市場別', '開盤價','最高價','最低價', '現價', '漲幅(%)', '9:40前漲停']
-            for i in range(rows):
-                for j in range(cols):
-                    item = QTableWidgetItem('-')
-                    if self.info_header[j] == '股票名稱':
-                        item.setText(self.table_dict[col_name].iloc[i, 1])
-                    elif self.info_header[j] == '股票代號':
-                        symbol = self.table_dict[col_name].iloc[i, 0].replace('.TW', '')
-                        item.setText(symbol)
-                        self.row_symbol_maps[col_name][symbol] = i
-                    elif self.info_header[j] == '漲幅(%)':
-                        item = NumericTableWidgetItem('-')
-                        
-
-                    table.setItem(i, j, item)
-
-            self.info_tab.addTab(table, col_name)
-            self.websocket.subscribe({
-                'channel': 'aggregates', 
-                'symbols': list(self.row_symbol_maps[col_name].keys())
-            })
-        self.info_tab.removeTab(0)
+        self.table_view_maps = {}
+        self.current_model = None
+        self.sector_tabs = []
+        self.info_tab.clear()
+
+        self.summary_table = QTableWidget(len(self.engine.sectors), len(SUMMARY_HEADER))
+        self.summary_table.setHorizontalHeaderLabels(SUMMARY_HEADER)
+        self.summary_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row, col_name in enumerate(self.engine.sectors):
+            self.summary_table.setItem(row, 0, QTableWidgetItem(col_name))
+            for col in range(1, len(SUMMARY_HEADER)):
+                self.summary_table.setItem(row, col, QTableWidgetItem('-'))
+        self.info_tab.addTab(self.summary_table, '類股總覽')
+
+        # 各類股先放空白頁，表格在第一次切換到該頁時才建立
+        self.sector_tabs = list(self.engine.sectors)
+        for col_name in self.sector_tabs:
+            page = QWidget()
+            page_layout = QVBoxLayout(page)
+            page_layout.setContentsMargins(0, 0, 0, 0)
+            self.info_tab.addTab(page, col_name)
+        self.summary_dirty = True
+        self.refresh_summary()
 
     def showDialog(self):
         my_target_path = None
@@ -385,17 +293,35 @@ class MainApp(QWidget):
             with open('target_list_path.pkl', 'wb') as f:
                 pickle.dump(temp_dict, f)
 
-    # 更新最新log到QPlainTextEdit的slot function
+    # log先放進緩衝區及log檔佇列，不直接碰QPlainTextEdit
     def print_log(self, log_info):
-        self.log_text.appendPlainText(log_info)
+        self.log_buffer.write(log_info)
+        self.file_log.write(log_info)
+
+    # QTimer定時把累積的log一次寫進面板
+    def flush_log(self):
+        lines = self.log_buffer.drain()
+        if not lines:
+            return
+        self.log_text.appendPlainText('\n'.join(lines))
         self.log_text.moveCursor(QTextCursor.End)
 
     # 視窗關閉時要做的事，主要是關websocket連結及存檔現在持有部位
     def closeEvent(self, event):
         
+        self.flush_timer.stop()
+        self.summary_timer.stop()
+        self.snapshot_timer.stop()
+        if self.metrics_panel is not None:
+            self.metrics_panel.close()
+        for line in self.engine.stats_lines():
+            self.print_log(line)
         self.print_log("disconnect websocket...")
-        self.websocket.disconnect()
+        self.engine.disconnect()
+        self.engine.close()
         sdk.logout()
+        self.log_timer.stop()
+        self.file_log.close()
 
         can_exit = True
         if can_exit:
@@ -404,17 +330,25 @@ class MainApp(QWidget):
             event.ignore()
 
 if __name__ == "__main__":
-    try:
-        sdk = FubonSDK()
-    except ValueError:
-        raise ValueError("請確認網路連線")
+    # 設定FAKE_MARKET_URL時改連本機假行情伺服器，不需登入
+    fake_url = os.environ.get(FAKE_URL_ENV)
+    if fake_url:
+        sdk = FakeSDK(fake_url)
+    else:
+        try:
+            sdk = FubonSDK()
+        except ValueError:
+            raise ValueError("請確認網路連線")
     
     if not QApplication.instance():
         app = QApplication(sys.argv)
     else:
         app = QApplication.instance()
     app.setStyleSheet("QWidget{font-size: 12pt;}")
-    form = LoginForm(MainApp, sdk, 'market.png')
+    if fake_url:
+        form = MainApp(sdk.fake_account)
+    else:
+        form = LoginForm(MainApp, sdk, 'market.png')
     form.show()
     
     sys.exit(app.exec())
\ No newline at end of file
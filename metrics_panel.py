@@ -0,0 +1,59 @@
+from PySide6.QtCore import QObject, QEvent, QTimer
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem
+
+from pipeline_metrics import BUCKET_BOUNDS_US, STAGE_LABELS
+
+
+class PaintFilter(QObject):
+    """表格viewport每次重繪時通知PipelineMetrics"""
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            self.metrics.on_painted()
+        return False
+
+
+def _format_ms(value):
+    return '-' if value is None else '{:.1f}'.format(value)
+
+
+class MetricsPanel(QWidget):
+    """各階段延遲分布，顯示時每秒更新一次"""
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.setWindowTitle('行情延遲統計')
+        self.resize(1100, 260)
+
+        bounds = ['≤{:g}ms'.format(bound / 1000) for bound in BUCKET_BOUNDS_US] + ['>{:g}ms'.format(BUCKET_BOUNDS_US[-1] / 1000)]
+        header = ['階段', '筆數', 'p50(ms)', 'p90(ms)', 'p99(ms)', '最大(ms)'] + bounds
+        self.table = QTableWidget(len(STAGE_LABELS), len(header))
+        self.table.setHorizontalHeaderLabels(header)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        for row in range(self.table.rowCount()):
+            for col in range(len(header)):
+                self.table.setItem(row, col, QTableWidgetItem('-'))
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.table)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start(1000)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        for row, (stage, count, p50, p90, p99, max_ms, counts) in enumerate(self.metrics.summary_rows()):
+            values = [STAGE_LABELS[stage], count, _format_ms(p50), _format_ms(p90), _format_ms(p99), _format_ms(max_ms)] + counts
+            for col, value in enumerate(values):
+                self.table.item(row, col).setText(str(value))
@@ -0,0 +1,164 @@
+import csv
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+# 設定此環境變數為資料夾路徑即開啟延遲統計，關閉視窗時輸出到該資料夾，例如 MARKET_METRICS_DIR=./metrics
+METRICS_DIR_ENV = 'MARKET_METRICS_DIR'
+
+# 固定的延遲分組上界(微秒)，最後再加一組無上限
+BUCKET_BOUNDS_US = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000,
+                    1000000, 2500000, 5000000, 10000000)
+
+# 各階段: 交易所時間 -> SDK callback收到 -> 解析完成 -> 寫進表格資料 -> 畫面重繪
+STAGES = ('exchange_recv', 'recv_decoded', 'decoded_applied', 'applied_painted', 'exchange_painted')
+STAGE_LABELS = {
+    'exchange_recv': '交易所→收到',
+    'recv_decoded': '收到→解析完成',
+    'decoded_applied': '解析完成→更新資料',
+    'applied_painted': '更新資料→重繪',
+    'exchange_painted': '交易所→重繪(總計)',
+}
+# 等待重繪的筆數上限，視窗縮小時不會重繪，只保留最近的部分
+MAX_AWAITING = 10000
+
+
+class Received:
+    """附帶收到時間的原始訊息，只在開啟延遲統計時使用"""
+    __slots__ = ('recv_ns', 'message')
+
+    def __init__(self, recv_ns, message):
+        self.recv_ns = recv_ns
+        self.message = message
+
+
+class LatencyHistogram:
+    """固定分組的延遲統計，record只做一次bisect及幾個整數相加"""
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_US) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, latency_us):
+        if latency_us < 0:
+            # 本機時鐘與交易所時鐘的誤差
+            latency_us = 0
+        self.counts[bisect_left(BUCKET_BOUNDS_US, latency_us)] += 1
+        self.count += 1
+        self.total += latency_us
+        if latency_us > self.max:
+            self.max = latency_us
+
+    def percentile(self, q):
+        # 以所在分組的上界估計，落在最後一組時回傳最大值
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKET_BOUNDS_US, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+class PipelineMetrics:
+    """行情處理各階段的延遲統計
+
+    解析執行緒呼叫on_decoded，使用端執行緒呼叫on_applied/await_paint/on_painted。
+    同一檔在套用前又收到新tick時保留最早那筆的時間，反映畫面實際落後多少。
+    """
+    def __init__(self, out_dir):
+        self.out_dir = Path(out_dir)
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._lock = threading.Lock()
+        self._pending = {}      # symbol -> (交易所時間us, 解析完成ns)
+        self._awaiting = deque(maxlen=MAX_AWAITING)     # [(交易所時間us, 套用時間ns), ...]
+
+    @classmethod
+    def from_env(cls):
+        out_dir = os.environ.get(METRICS_DIR_ENV)
+        return cls(out_dir) if out_dir else None
+
+    def on_decoded(self, symbol, exchange_us, recv_ns):
+        decoded_ns = time.time_ns()
+        histograms = self.histograms
+        histograms['exchange_recv'].record(recv_ns // 1000 - exchange_us)
+        histograms['recv_decoded'].record((decoded_ns - recv_ns) // 1000)
+        with self._lock:
+            if symbol not in self._pending:
+                self._pending[symbol] = (exchange_us, decoded_ns)
+
+    def on_applied(self, symbols):
+        # 回傳{symbol: (交易所時間us, 套用時間ns)}，供使用端決定哪些要等待重繪
+        applied_ns = time.time_ns()
+        record = self.histograms['decoded_applied'].record
+        applied = {}
+        with self._lock:
+            pending = self._pending
+            for symbol in symbols:
+                timing = pending.pop(symbol, None)
+                if timing is not None:
+                    record((applied_ns - timing[1]) // 1000)
+                    applied[symbol] = (timing[0], applied_ns)
+        return applied
+
+    def await_paint(self, timings):
+        self._awaiting.extend(timings)
+
+    def on_painted(self):
+        if not self._awaiting:
+            return
+        now_ns = time.time_ns()
+        applied_painted = self.histograms['applied_painted'].record
+        exchange_painted = self.histograms['exchange_painted'].record
+        for exchange_us, applied_ns in self._awaiting:
+            applied_painted((now_ns - applied_ns) // 1000)
+            exchange_painted(now_ns // 1000 - exchange_us)
+        self._awaiting.clear()
+
+    def summary_rows(self):
+        # [(階段, 筆數, p50, p90, p99, 最大, 各組筆數)]，時間單位為毫秒
+        rows = []
+        for stage in STAGES:
+            histogram = self.histograms[stage]
+            values = [histogram.percentile(q) for q in (0.5, 0.9, 0.99)] + [histogram.max if histogram.count else None]
+            rows.append((stage, histogram.count, *[None if v is None else v / 1000 for v in values], list(histogram.counts)))
+        return rows
+
+    def prometheus_text(self):
+        lines = ['# HELP market_pipeline_latency_seconds Tick latency per pipeline stage',
+                 '# TYPE market_pipeline_latency_seconds histogram']
+        for stage in STAGES:
+            histogram = self.histograms[stage]
+            cumulative = 0
+            for bound, count in zip(BUCKET_BOUNDS_US, histogram.counts):
+                cumulative += count
+                lines.append('market_pipeline_latency_seconds_bucket{{stage="{}",le="{:g}"}} {}'.format(stage, bound / 1000000, cumulative))
+            lines.append('market_pipeline_latency_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(stage, histogram.count))
+            lines.append('market_pipeline_latency_seconds_sum{{stage="{}"}} {:g}'.format(stage, histogram.total / 1000000))
+            lines.append('market_pipeline_latency_seconds_count{{stage="{}"}} {}'.format(stage, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        # 輸出Prometheus文字格式及CSV，回傳兩個檔案路徑
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        prom_path = self.out_dir / 'latency_{}.prom'.format(stamp)
+        csv_path = self.out_dir / 'latency_{}.csv'.format(stamp)
+        prom_path.write_text(self.prometheus_text(), encoding='utf-8')
+
+        bounds = ['{:g}'.format(bound / 1000) for bound in BUCKET_BOUNDS_US] + ['inf']
+        with open(csv_path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'count', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'] + ['le_{}ms'.format(b) for b in bounds])
+            for stage, count, p50, p90, p99, max_ms, counts in self.summary_rows():
+                writer.writerow([stage, count, p50, p90, p99, max_ms] + counts)
+        return prom_path, csv_path
@@ -0,0 +1,180 @@
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+# 設定此環境變數為資料夾路徑即在啟動時開始效能分析，例如 MARKET_PROFILE_DIR=./profiles
+PROFILE_DIR_ENV = 'MARKET_PROFILE_DIR'
+# 分析時間長度(秒)及取樣間隔(毫秒)
+PROFILE_SECONDS_ENV = 'MARKET_PROFILE_SECONDS'
+PROFILE_INTERVAL_ENV = 'MARKET_PROFILE_INTERVAL_MS'
+DEFAULT_PROFILE_DIR = './profiles'
+DEFAULT_SECONDS = 60
+DEFAULT_INTERVAL_MS = 5
+# tracemalloc每筆配置保留的呼叫層數
+TRACE_DEPTH = 25
+
+PROJECT_DIR = str(Path(__file__).resolve().parent)
+
+# 最內層為這些函式時表示執行緒在等待(佇列、Event、Condition、select)，不算進取樣結果
+IDLE_FRAMES = frozenset(['threading.wait', 'threading._wait_for_tstate_lock', 'threading.join', 'queue.get',
+                         'selectors.select', 'connection.wait', 'connection.poll'])
+# 在C函式內等待時最內層仍是呼叫的那一行，依該行原始碼判斷(time.sleep、Qt的exec事件迴圈)
+IDLE_CALLS = ('sleep(', '.exec(')
+# 專案函式統計只算這些執行緒: GUI及常駐模式的主執行緒、解析執行緒、分片接收執行緒。
+# SDK的websocket、REST查詢等執行緒多半在C函式內等網路，看不出是否忙碌，只留在folded堆疊中
+ATTRIBUTED_THREADS = frozenset(['MainThread', 'DecodeWorker', 'ShardReceiver'])
+
+
+def _is_project(filename):
+    return filename.startswith(PROJECT_DIR)
+
+
+def _frame_name(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return '{}.{}'.format(module, code.co_name)
+
+
+class SamplingProfiler:
+    """以sys._current_frames定時取樣所有執行緒的呼叫堆疊，同時以tracemalloc比較記憶體配置
+
+    取樣結果依「執行緒;外層;...;內層」合併成folded格式，可直接給flamegraph.pl或speedscope。
+    另外把每個樣本歸給堆疊中最內層的專案函式(例如handle_message、flush_ticks、read_watch_list)，
+    JSON解析等C函式不會出現在堆疊中，所以最內層專案函式另外標上行號以區分。
+    等待中的執行緒不算: 最內層為IDLE_FRAMES中的函式、最內層那行呼叫time.sleep或exec事件迴圈，
+    或最內層是模組層級(主程式在C函式內等待)。
+    """
+    def __init__(self, out_dir=DEFAULT_PROFILE_DIR, seconds=DEFAULT_SECONDS, interval_ms=DEFAULT_INTERVAL_MS):
+        self.out_dir = Path(out_dir)
+        self.seconds = seconds
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self.project = Counter()
+        self.samples = 0
+        self.busy = 0
+        self.attributed = 0
+        self.idle = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self.snapshot_start = None
+        self.snapshot_end = None
+        self._idle_lines = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls):
+        out_dir = os.environ.get(PROFILE_DIR_ENV)
+        if not out_dir:
+            return None
+        return cls(out_dir, float(os.environ.get(PROFILE_SECONDS_ENV, DEFAULT_SECONDS)),
+                   float(os.environ.get(PROFILE_INTERVAL_ENV, DEFAULT_INTERVAL_MS)))
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_DEPTH)
+        self.snapshot_start = tracemalloc.take_snapshot()
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        deadline = self.started_at + self.seconds
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._sample(names.get(thread_id, str(thread_id)), frame)
+            self.samples += 1
+        self.elapsed += time.perf_counter() - self.started_at
+        self.snapshot_end = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    def _sample(self, thread_name, frame):
+        if self._is_idle(frame):
+            self.idle += 1
+            return
+        self.busy += 1
+        stack = []
+        owner = None
+        while frame is not None:
+            code = frame.f_code
+            if owner is None and _is_project(code.co_filename):
+                owner = '{}:{}'.format(_frame_name(code), frame.f_lineno)
+            stack.append(_frame_name(code))
+            frame = frame.f_back
+        stack.append(thread_name)
+        stack.reverse()
+        self.stacks[';'.join(stack)] += 1
+        if thread_name in ATTRIBUTED_THREADS:
+            self.attributed += 1
+            if owner is not None:
+                self.project[owner] += 1
+
+    def _is_idle(self, frame):
+        code = frame.f_code
+        if code.co_name == '<module>' or _frame_name(code) in IDLE_FRAMES:
+            return True
+        if frame.f_lineno is None:
+            return False
+        key = (code.co_filename, frame.f_lineno)
+        idle = self._idle_lines.get(key)
+        if idle is None:
+            line = linecache.getline(*key)
+            idle = self._idle_lines[key] = any(call in line for call in IDLE_CALLS)
+        return idle
+
+    def dump(self):
+        # 輸出folded堆疊、專案函式統計及記憶體配置差異，回傳檔案路徑
+        self.stop()
+        if not self.samples:
+            return []
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        folded_path = self.out_dir / 'profile_{}.folded'.format(stamp)
+        summary_path = self.out_dir / 'profile_{}_project.txt'.format(stamp)
+        memory_path = self.out_dir / 'profile_{}_tracemalloc.txt'.format(stamp)
+
+        with open(folded_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+        # 比例以主執行緒及解析執行緒忙碌中的樣本為分母
+        busy = self.attributed or 1
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write('取樣{}次, 間隔{:.0f}ms, 共{:.1f}秒, 忙碌樣本{}筆(主執行緒及解析執行緒{}筆), 等待中略過{}筆\n'.format(
+                self.samples, self.interval*1000, self.elapsed, self.busy, self.attributed, self.idle))
+            f.write('最內層專案函式(含呼叫的C函式)   樣本數   佔忙碌比例\n')
+            for owner, count in self.project.most_common():
+                f.write('{:<50} {:>8} {:>6.1%}\n'.format(owner, count, count/busy))
+
+        with open(memory_path, 'w', encoding='utf-8') as f:
+            if self.snapshot_start is not None and self.snapshot_end is not None:
+                project_filter = [tracemalloc.Filter(True, PROJECT_DIR + os.sep + '*')]
+                stats = self.snapshot_end.filter_traces(project_filter).compare_to(
+                    self.snapshot_start.filter_traces(project_filter), 'lineno')
+                f.write('分析期間專案程式碼的記憶體配置變化(前50名)\n')
+                for stat in stats[:50]:
+                    f.write('{}\n'.format(stat))
+        return [folded_path, summary_path, memory_path]
@@ -1,16 +1,8 @@
 #%%
-import pandas as pd
+from watch_list import read_sectors
 
-watch_df = pd.read_excel('類股清單.xlsx')
-column_names = [col_name for col_name in watch_df.columns if 'Unnamed' not in col_name]
-table_dict = {}
-
-for i, col_name in enumerate(column_names):
-    table_dict[col_name] = watch_df.iloc[:, (2*i):(2*i+2)]
-    table_dict[col_name].columns = ['代碼', '名稱']
-    table_dict[col_name] = table_dict[col_name].iloc[1:, :]
-    table_dict[col_name] = table_dict[col_name].dropna(axis=0, how = 'all')
-    table_dict[col_name] = table_dict[col_name].reset_index(drop=True)
+# 類股清單的解析與快取在watch_list.read_sectors
+table_dict = read_sectors('類股清單.xlsx')
 # %%
 from PySide6.QtWidgets import QTableWidgetItem
 from PySide6.QtCore import Qt
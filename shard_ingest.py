@@ -0,0 +1,245 @@
+"""多行程分片接收行情
+
+觀察清單的股票依代號雜湊分給N個子行程，每個子行程有自己的行情連線、DecodeWorker及LimitUpEngine，
+JSON解析、篩選、去重及合併都在子行程完成，定時把每檔合併後的變動欄位打包成numpy結構陣列，
+經Pipe以bytes送回主行程，主行程解開後只做一次去重就放進自己的TickBuffer。
+開啟方式: 環境變數 MARKET_SHARDS=4(看盤視窗及常駐模式)，或常駐模式加上 --shards 4。
+
+子行程以spawn啟動，實際連線時各自用info.pkl登入。REST快照初始化及一分K回補仍由主行程負責，
+子行程重新連線後不做REST補齊。錄製行情、延遲統計及效能分析在子行程不啟用。
+"""
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from tick_recorder import RECORD_DIR_ENV, REPLAY_FILE_ENV
+from pipeline_metrics import METRICS_DIR_ENV
+from profiler import PROFILE_DIR_ENV
+
+# 分片數量，0或未設定為不分片
+SHARDS_ENV = 'MARKET_SHARDS'
+# 子行程送出合併後更新的間隔秒數
+SHARD_FLUSH_INTERVAL = 0.05
+# 結束時等待子行程的秒數，超過則強制結束
+SHARD_STOP_TIMEOUT = 3.0
+
+# 訊息類別，放在每筆bytes的第一個byte
+UPDATE_TAG = b'U'
+LOG_TAG = b'L'
+
+# 每檔一筆的更新，mask標示哪些欄位有值
+UPDATE_FIELDS = ('market', 'open', 'high', 'low', 'last', 'change', 'reference', 'limit_up', 'limit_up_bucket', 'limit_up_time')
+UPDATE_DTYPE = np.dtype([
+    ('symbol', 'S8'),
+    ('mask', 'u2'),
+    ('last_time', 'i8'),
+    ('market', 'S4'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('last', 'f8'),
+    ('change', 'f8'),
+    ('reference', 'f8'),
+    ('limit_up', '?'),
+    ('limit_up_bucket', 'i1'),
+    ('limit_up_time', 'i8'),
+])
+FIELD_BITS = {field: 1 << k for k, field in enumerate(UPDATE_FIELDS)}
+
+
+def shard_of(symbol, count):
+    # 不用內建hash，每次啟動及各行程的分片結果一致
+    return zlib.crc32(symbol.encode()) % count
+
+
+def pack_updates(pending, last_time):
+    # {symbol: fields} -> bytes
+    records = np.zeros(len(pending), dtype=UPDATE_DTYPE)
+    columns = {field: [] for field in UPDATE_FIELDS}
+    masks = []
+    for symbol, fields in pending.items():
+        mask = 0
+        for field in UPDATE_FIELDS:
+            value = fields.get(field)
+            if value is None:
+                columns[field].append(0)
+            else:
+                columns[field].append(value)
+                mask |= FIELD_BITS[field]
+        masks.append(mask)
+    records['symbol'] = [symbol.encode() for symbol in pending]
+    records['mask'] = masks
+    records['last_time'] = [last_time.get(symbol, 0) for symbol in pending]
+    records['market'] = [str(value).encode() if value else b'' for value in columns.pop('market')]
+    for field, values in columns.items():
+        records[field] = values
+    return records.tobytes()
+
+
+def unpack_updates(payload):
+    # bytes -> [(symbol, last_time, fields), ...]
+    records = np.frombuffer(payload, dtype=UPDATE_DTYPE)
+    masks = records['mask'].tolist()
+    columns = [(field, FIELD_BITS[field], records[field].tolist()) for field in UPDATE_FIELDS]
+    updates = []
+    for row, (symbol, tick_time, mask) in enumerate(zip(records['symbol'].tolist(), records['last_time'].tolist(), masks)):
+        fields = {}
+        for field, bit, values in columns:
+            if mask & bit:
+                value = values[row]
+                fields[field] = value.decode() if field == 'market' else value
+        updates.append((symbol.decode(), tick_time, fields))
+    return updates
+
+
+def _shard_main(shard_id, conn, fake_url, flush_interval):
+    # 子行程: 自己的行情連線及引擎，定時把合併後的更新送回主行程
+    # Ctrl+C只由主行程處理，再由stop通知子行程結束
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for env in (RECORD_DIR_ENV, REPLAY_FILE_ENV, METRICS_DIR_ENV, PROFILE_DIR_ENV):
+        os.environ.pop(env, None)
+    from limit_up_engine import LimitUpEngine, _login
+
+    send_lock = threading.Lock()
+
+    def send(tag, payload):
+        with send_lock:
+            conn.send_bytes(tag + payload)
+
+    def log(message):
+        send(LOG_TAG, str(message).encode())
+
+    if fake_url:
+        from fake_market import FakeSDK
+        sdk = FakeSDK(fake_url)
+        sdk.init_realtime()
+    else:
+        from fubon_neo.sdk import FubonSDK, Mode
+        sdk = FubonSDK()
+        _login(sdk)
+        sdk.init_realtime(Mode.Normal)
+
+    engine = LimitUpEngine(log=log)
+    engine.attach(sdk.marketdata.websocket_client.stock)
+    engine.websocket.connect()
+
+    try:
+        while True:
+            if conn.poll(flush_interval):
+                command, args = conn.recv()
+                if command == 'stop':
+                    break
+                if command == 'load':
+                    engine.load_sectors({'shard{}'.format(shard_id): [(symbol, symbol) for symbol in args]})
+            engine.subscriptions.check_timeouts()
+            pending = engine.tick_buffer.drain()
+            if pending:
+                send(UPDATE_TAG, pack_updates(pending, engine.last_time))
+    except (EOFError, OSError):
+        # 主行程已結束
+        pass
+    finally:
+        engine.disconnect()
+        engine.decode_worker.stop()
+        sdk.logout()
+
+
+class ShardedIngest:
+    """主行程端: 啟動子行程、分配股票，並由接收執行緒把更新送進引擎的DecodeWorker
+
+    更新以'shard'事件交給LimitUpEngine.handle_event，與REST快照依序處理，
+    較舊的資料一樣依每檔最後時間略過
+    """
+    def __init__(self, count, fake_url=None, flush_interval=SHARD_FLUSH_INTERVAL):
+        self.count = count
+        self.fake_url = fake_url
+        self.flush_interval = flush_interval
+        self.engine = None
+        self.processes = []
+        self.conns = []
+        self.receiver = None
+        self.running = False
+        self.batches = [0] * count
+        self.updates = [0] * count
+        self.symbols = [0] * count
+
+    @classmethod
+    def from_env(cls, fake_url=None):
+        count = int(os.environ.get(SHARDS_ENV) or 0)
+        return cls(count, fake_url) if count > 0 else None
+
+    def start(self, engine):
+        self.engine = engine
+        self.running = True
+        context = multiprocessing.get_context('spawn')
+        for shard_id in range(self.count):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_shard_main, args=(shard_id, child_conn, self.fake_url, self.flush_interval),
+                                      name='Shard{}'.format(shard_id), daemon=True)
+            process.start()
+            child_conn.close()
+            self.processes.append(process)
+            self.conns.append(parent_conn)
+        self.receiver = threading.Thread(target=self._receive, name='ShardReceiver', daemon=True)
+        self.receiver.start()
+        engine.log('分片接收: 啟動{}個子行程'.format(self.count))
+
+    def load(self, symbols):
+        shards = [[] for _ in range(self.count)]
+        for symbol in symbols:
+            shards[shard_of(symbol, self.count)].append(symbol)
+        for shard_id, (conn, shard_symbols) in enumerate(zip(self.conns, shards)):
+            self.symbols[shard_id] = len(shard_symbols)
+            conn.send(('load', shard_symbols))
+
+    def _receive(self):
+        shard_ids = {conn: shard_id for shard_id, conn in enumerate(self.conns)}
+        conns = list(self.conns)
+        engine = self.engine
+        while conns and self.running:
+            for conn in wait(conns, timeout=0.5):
+                shard_id = shard_ids[conn]
+                try:
+                    message = conn.recv_bytes()
+                except (EOFError, OSError):
+                    conns.remove(conn)
+                    if self.running:
+                        engine.log('分片{}子行程已結束'.format(shard_id))
+                    continue
+                tag, payload = message[:1], message[1:]
+                if tag == UPDATE_TAG:
+                    updates = unpack_updates(payload)
+                    self.batches[shard_id] += 1
+                    self.updates[shard_id] += len(updates)
+                    engine.decode_worker.submit_event('shard', updates)
+                elif tag == LOG_TAG:
+                    engine.log('[分片{}] {}'.format(shard_id, payload.decode()))
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for conn in self.conns:
+            try:
+                conn.send(('stop', None))
+            except OSError:
+                pass
+        deadline = time.monotonic() + SHARD_STOP_TIMEOUT
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+        if self.receiver is not None:
+            self.receiver.join(1)
+        for conn in self.conns:
+            conn.close()
+
+    def stats_text(self):
+        return '分片統計: ' + ', '.join('分片{} {}檔 批次{}次 更新{}筆'.format(k, self.symbols[k], self.batches[k], self.updates[k])
+                                     for k in range(self.count))
@@ -0,0 +1,167 @@
+import threading
+import time
+
+# 每次subscribe請求最多帶的股票數，超過時拆成多個請求
+SUBSCRIBE_CHUNK_SIZE = 100
+# 送出後多久沒收到subscribed視為遺失並重送(秒)
+ACK_TIMEOUT = 5.0
+MAX_RETRIES = 3
+
+
+class SubscriptionManager:
+    """管理websocket行情訂閱
+
+    所有類股的股票合併去重後只訂閱一次，依chunk_size分批送出。
+    送出後放進pending，收到subscribed事件時依symbol移到acked(symbol -> 訂閱id)並記錄延遲，
+    check_timeouts定時把逾時未確認的股票重送，超過重送次數則放棄並記錄。
+
+    subscribe/check_timeouts由使用端執行緒呼叫，on_subscribed/on_unsubscribed由DecodeWorker執行緒呼叫。
+    """
+    def __init__(self, websocket, log=print, channel='aggregates', chunk_size=SUBSCRIBE_CHUNK_SIZE,
+                 ack_timeout=ACK_TIMEOUT, max_retries=MAX_RETRIES):
+        self.websocket = websocket
+        self.log = log
+        self.channel = channel
+        self.chunk_size = chunk_size
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        self.symbols = []       # 要訂閱的股票，依加入順序
+        self.pending = {}       # symbol -> [送出時間, 已送出次數]
+        self.acked = {}         # symbol -> 訂閱id
+        self.failed = set()
+        self.latencies = []     # 每檔從第一次送出到確認的秒數
+        self.first_sent = {}
+        self.retries = 0
+        self.requests = 0
+        self.batch_start = None
+
+    def _send(self, symbols, now):
+        for i in range(0, len(symbols), self.chunk_size):
+            chunk = symbols[i:i+self.chunk_size]
+            self.websocket.subscribe({
+                'channel': self.channel,
+                'symbols': chunk
+            })
+            self.requests += 1
+        for symbol in symbols:
+            entry = self.pending.get(symbol)
+            if entry is None:
+                self.pending[symbol] = [now, 1]
+                self.first_sent[symbol] = now
+            else:
+                entry[0] = now
+                entry[1] += 1
+
+    def subscribe(self, symbols):
+        # 只送出第一次加入的股票，已訂閱或等待確認中的不重複送，回傳實際送出的檔數
+        now = time.perf_counter()
+        with self._lock:
+            known = set(self.symbols)
+            new_symbols = []
+            for symbol in symbols:
+                if symbol in known:
+                    continue
+                known.add(symbol)
+                self.symbols.append(symbol)
+                if symbol not in self.acked and symbol not in self.pending:
+                    new_symbols.append(symbol)
+            if new_symbols:
+                if not self.pending:
+                    self.batch_start = now
+                self.failed.difference_update(new_symbols)
+                self._send(new_symbols, now)
+        return len(new_symbols)
+
+    def resubscribe_all(self):
+        # 重新連線後舊的訂閱id已失效，全部清掉後一次批次重送
+        now = time.perf_counter()
+        with self._lock:
+            self.acked.clear()
+            self.pending.clear()
+            self.first_sent.clear()
+            self.failed.clear()
+            self.batch_start = now
+            if self.symbols:
+                self._send(self.symbols, now)
+        return len(self.symbols)
+
+    def unsubscribe(self, symbols):
+        with self._lock:
+            ids = [self.acked[symbol] for symbol in symbols if symbol in self.acked]
+            removed = set(symbols)
+            self.symbols = [symbol for symbol in self.symbols if symbol not in removed]
+            for symbol in removed:
+                self.pending.pop(symbol, None)
+        if ids:
+            self.websocket.unsubscribe({'ids': ids})
+
+    def on_subscribed(self, data):
+        records = data if type(data) == list else [data]
+        now = time.perf_counter()
+        with self._lock:
+            for record in records:
+                symbol = record['symbol']
+                self.acked[symbol] = record['id']
+                if self.pending.pop(symbol, None) is not None:
+                    self.latencies.append(now - self.first_sent.pop(symbol, now))
+                self.log('訂閱成功...'+symbol)
+            done = not self.pending and self.batch_start is not None
+            if done:
+                elapsed = now - self.batch_start
+                self.batch_start = None
+        if done:
+            self.log('訂閱完成: {}檔, 耗時{:.0f}ms, {}'.format(len(self.acked), elapsed*1000, self.latency_text()))
+
+    def on_unsubscribed(self, data):
+        records = data if type(data) == list else [data]
+        with self._lock:
+            for record in records:
+                symbol = record['symbol']
+                if self.acked.get(symbol) == record['id']:
+                    del self.acked[symbol]
+                self.log('取消訂閱...'+symbol)
+
+    def check_timeouts(self):
+        # 由使用端定時呼叫，沒有等待中的訂閱時直接返回
+        if not self.pending:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            expired = [symbol for symbol, (sent, _) in self.pending.items() if now - sent >= self.ack_timeout]
+            if not expired:
+                return
+            retry = [symbol for symbol in expired if self.pending[symbol][1] <= self.max_retries]
+            for symbol in expired:
+                if self.pending[symbol][1] > self.max_retries:
+                    del self.pending[symbol]
+                    self.first_sent.pop(symbol, None)
+                    self.failed.add(symbol)
+            if retry:
+                self.retries += len(retry)
+                self._send(retry, now)
+            if not self.pending:
+                self.batch_start = None
+        if retry:
+            self.log('訂閱逾時重送{}檔'.format(len(retry)))
+        if len(retry) < len(expired):
+            self.log('訂閱失敗{}檔: {}'.format(len(expired)-len(retry), ','.join(s for s in expired if s not in retry)))
+
+    def latency_text(self):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return '訂閱延遲: 無資料'
+        p50 = latencies[len(latencies)//2]
+        p99 = latencies[min(len(latencies)-1, int(len(latencies)*0.99))]
+        return '訂閱延遲 中位數{:.0f}ms, p99 {:.0f}ms, 最大{:.0f}ms'.format(p50*1000, p99*1000, latencies[-1]*1000)
+
+    def stats(self):
+        return {
+            'symbols': len(self.symbols),
+            'acked': len(self.acked),
+            'pending': len(self.pending),
+            'failed': len(self.failed),
+            'requests': self.requests,
+            'retries': self.retries,
+        }
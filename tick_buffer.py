@@ -0,0 +1,41 @@
+import threading
+
+
+class TickBuffer:
+    """每個股票只保留最新一筆待更新欄位的緩衝區
+
+    websocket執行緒呼叫put寫入，GUI端的QTimer定時呼叫drain一次取出全部，
+    在同一次flush之前重複進來的tick會合併成一筆，並累計被合併掉的數量
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.received = 0
+        self.conflated = 0
+        self.flushed = 0
+
+    def put(self, symbol, fields):
+        with self._lock:
+            self.received += 1
+            pending = self._pending.get(symbol)
+            if pending is None:
+                self._pending[symbol] = fields
+            else:
+                # 後到的欄位覆蓋前面的值，沒出現的欄位(如9:40前漲停)保留
+                pending.update(fields)
+                self.conflated += 1
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self.flushed += len(pending)
+        return pending
+
+    def stats(self):
+        with self._lock:
+            return {
+                'received': self.received,
+                'conflated': self.conflated,
+                'flushed': self.flushed,
+                'pending': len(self._pending),
+            }
@@ -0,0 +1,135 @@
+import json
+import queue
+import re
+import threading
+
+from pipeline_metrics import Received
+
+# 有安裝較快的JSON套件時優先使用
+try:
+    import orjson
+    fast_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        fast_loads = ujson.loads
+    except ImportError:
+        fast_loads = json.loads
+
+# 解析佇列上限，超過時直接丟棄新訊息，不讓SDK的callback執行緒等待
+QUEUE_SIZE = 20000
+
+# 不需要處理的事件
+IGNORED_EVENTS = frozenset(['heartbeat', 'pong', 'authenticated'])
+
+_EVENT_RE = re.compile(r'"event"\s*:\s*"(\w+)"')
+_SYMBOL_RE = re.compile(r'"symbol"\s*:\s*"([^"]+)"')
+_TRIAL_RE = re.compile(r'"isTrial"\s*:\s*true')
+
+
+class DecodeWorker(threading.Thread):
+    """行情訊息解析執行緒
+
+    SDK的callback只呼叫submit把原始字串放進有上限的佇列，
+    本執行緒先用字串比對篩掉不需要的訊息(心跳、試撮、未訂閱的股票)，
+    通過的才做完整的JSON解析，再交給handler(event, data)處理
+    """
+    def __init__(self, handler, loads=None, maxsize=QUEUE_SIZE, log=print):
+        super().__init__(name='DecodeWorker', daemon=True)
+        self.handler = handler
+        self.log = log
+        self.loads = loads or fast_loads
+        self.queue = queue.Queue(maxsize)
+        # 目前訂閱中的股票，None表示不依股票篩選
+        self.symbols = None
+
+        # 目前處理中訊息的收到時間(ns)，只在開啟延遲統計時有值
+        self.recv_ns = 0
+
+        self.submitted = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.decoded = 0
+        self.errors = 0
+
+    def submit(self, message):
+        self.submitted += 1
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def submit_event(self, event, data):
+        # 已解析好的事件(例如REST查詢結果)也經由本執行緒交給handler，與websocket行情依序處理
+        self.queue.put((event, data))
+
+    def set_symbols(self, symbols):
+        # 整個替換，解析執行緒讀到的永遠是完整的集合
+        self.symbols = frozenset(symbols)
+
+    def accept(self, message):
+        # 不做JSON解析的快速篩選，回傳False表示直接丟棄
+        match = _EVENT_RE.search(message)
+        if match is None:
+            return True
+
+        event = match.group(1)
+        if event in IGNORED_EVENTS:
+            return False
+
+        if event == 'data' or event == 'snapshot':
+            if event == 'data' and _TRIAL_RE.search(message):
+                return False
+            symbols = self.symbols
+            if symbols is not None:
+                match = _SYMBOL_RE.search(message)
+                if match is not None and match.group(1) not in symbols:
+                    return False
+
+        return True
+
+    def run(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            if type(message) is tuple:
+                # 解析好的事件(REST查詢結果等)出錯時也不能讓本執行緒結束
+                try:
+                    self.handler(*message)
+                except Exception as e:
+                    self.errors += 1
+                    self.log('event error: {} {!r} {}'.format(message[0], e, message[1]))
+                continue
+            if type(message) is Received:
+                self.recv_ns = message.recv_ns
+                message = message.message
+
+            if not self.accept(message):
+                self.rejected += 1
+                continue
+
+            try:
+                msg = self.loads(message)
+                self.decoded += 1
+                self.handler(msg['event'], msg['data'])
+            except Exception as e:
+                self.errors += 1
+                self.log('decode error: {!r} {}'.format(e, message))
+
+    def stop(self, timeout=1):
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.join(timeout)
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'decoded': self.decoded,
+            'errors': self.errors,
+            'queued': self.queue.qsize(),
+        }
@@ -0,0 +1,135 @@
+import argparse
+import gzip
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# 設定此環境變數為資料夾路徑即開啟錄製，例如 MARKET_RECORD_DIR=./records
+RECORD_DIR_ENV = 'MARKET_RECORD_DIR'
+# 設定紀錄檔路徑後，讀取清單時會把紀錄檔重播進看盤程式，速度由MARKET_REPLAY_SPEED設定
+REPLAY_FILE_ENV = 'MARKET_REPLAY_FILE'
+REPLAY_SPEED_ENV = 'MARKET_REPLAY_SPEED'
+
+# 每筆紀錄: 收到時間(ns, int64) + 訊息長度(uint32) + utf-8訊息內容
+_HEADER = struct.Struct('<qI')
+
+
+class TickRecorder:
+    """把websocket收到的原始訊息連同收到時間寫進gzip壓縮的紀錄檔
+
+    write只把資料放進佇列，壓縮及寫檔在背景執行緒進行，不影響SDK的callback執行緒
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.queue = queue.SimpleQueue()
+        self.count = 0
+        self._thread = threading.Thread(target=self._run, name='TickRecorder', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls):
+        record_dir = os.environ.get(RECORD_DIR_ENV)
+        if not record_dir:
+            return None
+        file_name = datetime.now().strftime('market_%Y%m%d_%H%M%S.rec.gz')
+        return cls(Path(record_dir) / file_name)
+
+    def write(self, message):
+        self.queue.put((time.time_ns(), message))
+
+    def _run(self):
+        with gzip.open(self.path, 'ab', compresslevel=6) as f:
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                recv_ns, message = record
+                if isinstance(message, str):
+                    message = message.encode('utf-8')
+                f.write(_HEADER.pack(recv_ns, len(message)))
+                f.write(message)
+                self.count += 1
+
+    def close(self, timeout=5):
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+
+def read_records(path):
+    # 依序讀出(收到時間ns, 原始訊息字串)
+    with gzip.open(path, 'rb') as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                break
+            recv_ns, length = _HEADER.unpack(header)
+            yield recv_ns, f.read(length).decode('utf-8')
+
+
+def replay(path, handler, speed=1.0, stop_event=None):
+    """把紀錄檔中的訊息依原本的時間間隔送進handler(message)
+
+    speed=1為實際速度，N為N倍速，0為不等待、盡快送出
+    回傳送出的訊息數
+    """
+    count = 0
+    start_ns = None
+    start_clock = None
+    for recv_ns, message in read_records(path):
+        if stop_event is not None and stop_event.is_set():
+            break
+        if speed > 0:
+            if start_ns is None:
+                start_ns = recv_ns
+                start_clock = time.perf_counter()
+            delay = (recv_ns - start_ns) / 1e9 / speed - (time.perf_counter() - start_clock)
+            if delay > 0:
+                time.sleep(delay)
+        handler(message)
+        count += 1
+    return count
+
+
+def start_replay(path, handler, speed=1.0):
+    # 在背景執行緒重播，回傳(thread, stop_event)
+    stop_event = threading.Event()
+    thread = threading.Thread(target=replay, args=(path, handler, speed, stop_event), name='TickReplay', daemon=True)
+    thread.start()
+    return thread, stop_event
+
+
+def main(argv=None):
+    # 不開GUI，把紀錄檔重播進DecodeWorker，統計各事件數量及處理速度
+    from tick_decoder import DecodeWorker
+
+    parser = argparse.ArgumentParser(description='重播行情紀錄檔')
+    parser.add_argument('path')
+    parser.add_argument('--speed', type=float, default=0, help='1為實際速度, N為N倍速, 0為盡快送出(預設)')
+    args = parser.parse_args(argv)
+
+    event_counts = {}
+
+    def count_event(event, data):
+        event_counts[event] = event_counts.get(event, 0) + 1
+
+    worker = DecodeWorker(count_event)
+    worker.start()
+    start = time.perf_counter()
+    # 用會等待的put，盡快重播時不因佇列滿而丟訊息
+    count = replay(args.path, worker.queue.put, args.speed)
+    worker.stop(timeout=60)
+    elapsed = time.perf_counter() - start
+
+    print('replayed {} messages in {:.2f}s ({:.0f} msg/s)'.format(count, elapsed, count/elapsed if elapsed else 0))
+    print('decoder:', worker.stats())
+    print('events:', event_counts)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
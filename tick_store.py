@@ -0,0 +1,68 @@
+import numpy as np
+
+# 每檔股票保留的tick筆數，超過時覆蓋最舊的資料
+TICK_CAPACITY = 2048
+
+
+class TickStore:
+    """盤中逐筆資料，每檔股票一段預先配置好的環狀緩衝區
+
+    欄位分開存放(時間、價格、漲幅、累計成交量)，每個欄位是(股票數, 2*capacity)的陣列。
+    每筆資料同時寫在slot及slot+capacity兩個位置，所以最近的任意N筆永遠是一段連續記憶體，
+    last/window回傳的都是不複製資料的numpy view。
+    記憶體用量固定為 股票數 * capacity * 2 * 20 bytes，不隨盤中時間增加。
+
+    append只應由單一執行緒(DecodeWorker)呼叫。
+    """
+    def __init__(self, symbols, capacity=TICK_CAPACITY):
+        self.symbols = list(symbols)
+        self.symbol_idx = dict(zip(self.symbols, range(len(self.symbols))))
+        self.capacity = capacity
+
+        n = len(self.symbols)
+        self.time = np.zeros((n, 2*capacity), dtype=np.int64)      # lastUpdated(微秒)
+        self.price = np.zeros((n, 2*capacity), dtype=np.float32)
+        self.change = np.zeros((n, 2*capacity), dtype=np.float32)
+        self.volume = np.zeros((n, 2*capacity), dtype=np.uint32)   # 累計成交量(張)
+        # 每檔累計寫入的筆數
+        self.head = np.zeros(n, dtype=np.int64)
+
+    @property
+    def nbytes(self):
+        return self.time.nbytes + self.price.nbytes + self.change.nbytes + self.volume.nbytes + self.head.nbytes
+
+    def append(self, idx, tick_time, price, change, volume):
+        head = self.head[idx]
+        slot = head % self.capacity
+        mirror = slot + self.capacity
+        self.time[idx, slot] = self.time[idx, mirror] = tick_time
+        self.price[idx, slot] = self.price[idx, mirror] = price
+        self.change[idx, slot] = self.change[idx, mirror] = change
+        self.volume[idx, slot] = self.volume[idx, mirror] = volume
+        self.head[idx] = head + 1
+
+    def count(self, idx):
+        return min(int(self.head[idx]), self.capacity)
+
+    def _span(self, idx, n):
+        n = min(n, self.count(idx))
+        end = int(self.head[idx] % self.capacity) + self.capacity
+        return end-n, end
+
+    def last(self, idx, n):
+        # 最近n筆，依時間由舊到新，回傳(time, price, change, volume)四個view
+        start, end = self._span(idx, n)
+        return (self.time[idx, start:end], self.price[idx, start:end],
+                self.change[idx, start:end], self.volume[idx, start:end])
+
+    def window(self, idx, minutes, now=None):
+        # 最近幾分鐘內的資料，now未指定時以該檔最後一筆的時間為準
+        start, end = self._span(idx, self.capacity)
+        if start == end:
+            return self.last(idx, 0)
+        times = self.time[idx, start:end]
+        if now is None:
+            now = times[-1]
+        first = start + int(np.searchsorted(times, now - int(minutes*60*1000000), side='left'))
+        return (self.time[idx, first:end], self.price[idx, first:end],
+                self.change[idx, first:end], self.volume[idx, first:end])
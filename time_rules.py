@@ -0,0 +1,72 @@
+import os
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+# 漲停時間分組，逗號分隔的HH:MM，例如 LIMIT_UP_CUTOFFS=09:05,09:15,09:40,10:30
+CUTOFFS_ENV = 'LIMIT_UP_CUTOFFS'
+DEFAULT_CUTOFFS = ('09:05', '09:15', '09:40', '10:30')
+
+
+def _parse(cutoff):
+    hour, minute = (int(v) for v in cutoff.split(':'))
+    return hour, minute
+
+
+class TimeRules:
+    """依漲停時間分組的規則
+
+    bucket(t)回傳t落在第幾個時段: 早於第一個時間為0，介於第k、k+1個時間之間為k+1，都過了為count，
+    所以「在第k個時間前漲停」等於bucket <= k，每筆tick只做一次bisect，與規則數量無關。
+    目前交易日的門檻只由advance在較晚的一天換算，其他日期(例如前一天的K棒)只在bucket內另外換算，不改變目前交易日。
+    """
+    def __init__(self, cutoffs=DEFAULT_CUTOFFS):
+        self.cutoffs = sorted((_parse(cutoff) for cutoff in cutoffs))
+        self.count = len(self.cutoffs)
+        self.labels = ['{}:{:02d}前漲停'.format(hour, minute) for hour, minute in self.cutoffs]
+        self.day_start = 0
+        self.day_end = 0
+        self.thresholds = []
+        self._compile(int(datetime.now().timestamp()*1000000))
+
+    @classmethod
+    def from_env(cls):
+        cutoffs = os.environ.get(CUTOFFS_ENV)
+        if not cutoffs:
+            return cls()
+        return cls([cutoff.strip() for cutoff in cutoffs.split(',') if cutoff.strip()])
+
+    def _day_of(self, tick_time):
+        return datetime.fromtimestamp(tick_time / 1000000).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def thresholds_for(self, tick_time):
+        # tick_time所在日期的各門檻(微秒)，不改變目前編譯好的門檻
+        day = self._day_of(tick_time)
+        return [int(day.replace(hour=hour, minute=minute).timestamp()*1000000) for hour, minute in self.cutoffs]
+
+    def latest_passed(self, tick_time):
+        # 當天已經過的最晚門檻，還沒過任何門檻時為0
+        passed = [threshold for threshold in self.thresholds_for(tick_time) if threshold <= tick_time]
+        return passed[-1] if passed else 0
+
+    def _compile(self, tick_time):
+        day = self._day_of(tick_time)
+        self.day_start = int(day.timestamp()*1000000)
+        self.day_end = int((day + timedelta(days=1)).timestamp()*1000000)
+        self.thresholds = self.thresholds_for(tick_time)
+
+    def advance(self, tick_time):
+        # tick_time已是較晚的一天時改用該日的門檻並回傳True，使用端據此清除前一天的漲停狀態
+        if tick_time < self.day_end:
+            return False
+        self._compile(tick_time)
+        return True
+
+    def bucket(self, tick_time):
+        # tick_time為lastUpdated(微秒)
+        if not self.day_start <= tick_time < self.day_end:
+            return bisect_right(self.thresholds_for(tick_time), tick_time)
+        return bisect_right(self.thresholds, tick_time)
+
+    def label_of(self, bucket):
+        # 最早符合的規則名稱，bucket為count時表示都不符合
+        return self.labels[bucket] if bucket < self.count else None
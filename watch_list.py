@@ -0,0 +1,58 @@
+import os
+import pickle
+from pathlib import Path
+
+# 解析後的類股清單快取，{Excel絕對路徑: (檔案大小, 修改時間ns, sectors)}
+CACHE_FILE = Path('./watch_list_cache.pkl')
+
+
+def _cache_key(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return {}
+
+
+def parse_sectors(file_path):
+    # 讀取類股清單Excel，每個類股佔兩欄(代碼, 名稱)，第一列為欄位說明
+    import pandas as pd
+
+    watch_df = pd.read_excel(file_path)
+    column_names = [col_name for col_name in watch_df.columns if 'Unnamed' not in col_name]
+    sectors = {}
+    for i, col_name in enumerate(column_names):
+        # 整欄一次取出，不逐格iloc
+        codes = watch_df.iloc[1:, 2*i].tolist()
+        names = watch_df.iloc[1:, 2*i+1].tolist()
+        sectors[col_name] = [(str(code).replace('.TW', ''), name) for code, name in zip(codes, names)
+                             if not (pd.isna(code) and pd.isna(name))]
+    return sectors
+
+
+def read_sectors(file_path, use_cache=True):
+    """回傳{類股名稱: [(股票代號, 股票名稱), ...]}
+
+    Excel的大小及修改時間沒變時直接讀快取，不載入pandas也不解析Excel
+    """
+    path = str(Path(file_path).resolve())
+    key = _cache_key(path)
+    cache = _load_cache() if use_cache else {}
+    cached = cache.get(path)
+    if cached is not None and cached[:2] == key:
+        return cached[2]
+
+    sectors = parse_sectors(path)
+    if use_cache:
+        cache[path] = key + (sectors,)
+        try:
+            with open(CACHE_FILE, 'wb') as f:
+                pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+    return sectors